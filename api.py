@@ -0,0 +1,24 @@
+"""
+This is the headless HTTP API of the chatbot, an ASGI application next to the Streamlit app in app.py.
+It serves chat messages, with optional server-sent-event streaming, schedule listings and ODSL execution
+to programmatic clients; see module/chat_api.py for the endpoints.
+
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Chat sessions live in the process, so run a single worker process per instance,
+and pin clients to an instance (sticky sessions) behind a load balancer.
+"""
+import logging
+from module.chat_api import ChatAPI
+
+# Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler("output.log", encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+
+app = ChatAPI()
@@ -9,13 +9,14 @@ streamlit_chat uses the avarta_style from https://www.dicebear.com/styles/.
 
 https://docs.streamlit.io/library/cheatsheet
 """
-import time
 import streamlit as st
 import logging
 from uuid import uuid4 as uuid
 from streamlit_chat import message
-from module.chat_flow import ChatBot
-from module.method_util import get_func_list
+from module.method_util import get_aoai_client, get_func_list
+from module.app_config import get_config
+from module.odsl_interpreter import format_results
+from module.session_pool import SessionBusyError, SessionPool
 
 # Logging configuration
 for handler in logging.root.handlers[:]:
@@ -30,10 +31,26 @@ logging.basicConfig(
     ]
 )
 
+# Fail on invalid settings at startup rather than in the middle of a request
+get_aoai_client(get_config().azure_openai)
+
+
+@st.cache_resource
+def get_session_pool() -> SessionPool:
+    # one pool per process: every browser session shares its Graph and LLM clients
+    return SessionPool()
+
+
+def trim_session_messages():
+    max_history = get_config().sessions.max_history
+    for key in ("messages", "odsl", "plans"):
+        del st.session_state[key][:-max_history]
+
 
 def on_clear_msgs():
     st.session_state.messages = []
     st.session_state.odsl = []
+    st.session_state.plans = []
 
 
 header_img = st.empty()
@@ -45,13 +62,20 @@ header_img.image(
 st.title("Mini-Copilot")
 st.button("Clear message", on_click=on_clear_msgs)
 
+if "session_id" not in st.session_state:
+    # the key of this browser session's ChatBot in the shared pool
+    st.session_state.session_id = str(uuid())
+
 if "messages" not in st.session_state:
-    st.session_state.chat = ChatBot()
     st.session_state["messages"] = []
     st.session_state["odsl"] = []
+    st.session_state["plans"] = []
 
 chat_container = st.container()
 sidebar_container = st.sidebar
+session_pool = get_session_pool()
+session_pool.get(st.session_state.session_id).chatbot.dry_run = sidebar_container.checkbox(
+    "Dry run (plan ODSL commands without executing them)")
 # sidebar width
 st.markdown(
     """
@@ -81,18 +105,35 @@ with chat_container:
         message(key=str(uuid()), message=prompt,
                 is_user=True, avatar_style="lorelei-neutral")
 
-        respond = ''
+        respond, last_plan, last_results = '', '', []
         with st.chat_message("assistant"):
+            # render the reply as it streams in; the last piece is the final reply
+            placeholder = st.empty()
             try:
-                respond = st.session_state.chat.send_message(prompt)
+                with session_pool.acquire(st.session_state.session_id) as chat:
+                    try:
+                        if get_config().intent.pipelined:
+                            # speculative branches are not streamed
+                            respond = chat.send_message(prompt)
+                            placeholder.text(respond)
+                        else:
+                            for respond in chat.send_message_stream(prompt):
+                                placeholder.text(respond)
+                    finally:
+                        last_plan, last_results = chat.last_plan, chat.last_results
+            except SessionBusyError:
+                st.warning("Still answering your previous message, please wait.")
+                respond = ''
             except Exception as e:
-                st.error(e)
-
-        messages = []
-        time.sleep(0.5)
+                if any(not result.succeeded for result in last_results):
+                    # a partly failed batch: show which commands failed
+                    st.error(format_results(last_results))
+                    st.session_state.plans.append(f'{last_plan}\n{format_results(last_results)}')
+                else:
+                    st.error(e)
+                respond = ''
 
         if respond:
-            message(respond, avatar_style="micah")
             st.session_state.messages.append(
                 {"role": "assistant", "content": respond})
 
@@ -100,6 +141,8 @@ with chat_container:
 
             if any(func in respond for func in func_list):
                 st.session_state.odsl.append(respond)
+                st.session_state.plans.append(last_plan)
+        trim_session_messages()
 
 
 with sidebar_container:
@@ -110,3 +153,7 @@ with sidebar_container:
 
     for _message in st.session_state.odsl:
         sidebar_inner_container.markdown(f'```{_message}```')
+
+    sidebar_inner_container.write("Execution plan:")
+    for _plan in st.session_state.plans:
+        sidebar_inner_container.code(_plan)
@@ -0,0 +1,453 @@
+"""
+Local stand-in for the Microsoft Graph calendar API and its token authority.
+
+FakeGraphServer serves HTTPS on localhost with a self-signed certificate and implements what O365Client uses:
+- the OpenID configuration and client-credentials token endpoints MSAL talks to,
+- events CRUD of a user's calendar, calendarView and calendarView/delta, with $top paging through nextLink,
+- JSON $batch with dependsOn.
+Latency and 429 responses with a Retry-After header can be injected, so client changes can be measured offline.
+
+    python -m benchmark.fake_graph [--port 8443] [--latency 0.02] [--throttle-rate 0.1]
+
+prints the settings that point the app at the running server.
+"""
+import argparse
+import datetime as dt
+import ipaddress
+import json
+import os
+import random
+import re
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from module.app_config import AppConfig, GraphSettings
+
+GRAPH_PREFIX = "/v1.0"
+TOKEN_LIFETIME = 3600
+DEFAULT_PAGE_SIZE = 10
+# Graph's dateTime format, which sorts chronologically
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.0000000"
+
+_EVENTS = re.compile(r"^/users/[^/]+/calendar/events$")
+_EVENT = re.compile(r"^/users/[^/]+/calendar/events/([^/]+)$")
+_CALENDAR_VIEW = re.compile(r"^/users/[^/]+/calendar/calendarView$")
+_CALENDAR_DELTA = re.compile(r"^/users/[^/]+/calendar/calendarView/delta$")
+_OPENID = re.compile(r"^/([^/]+)/v2\.0/\.well-known/openid-configuration$")
+_TOKEN = re.compile(r"^/([^/]+)/oauth2/v2\.0/token$")
+
+Response = Tuple[int, dict, Optional[dict]]
+
+
+def _self_signed_certificate(directory: str) -> Tuple[str, str]:
+    # a certificate for localhost and 127.0.0.1 that doubles as the CA bundle clients trust
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = dt.datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - dt.timedelta(days=1))
+            .not_valid_after(now + dt.timedelta(days=30))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"),
+                                                        x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+                           critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256()))
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def _graph_datetime(value: dict) -> str:
+    # dateTimeTimeZone -> UTC dateTime as Graph returns it
+    parsed = dt.datetime.fromisoformat(value["dateTime"].rstrip("Z")[:26])
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return parsed.strftime(DATETIME_FORMAT)
+
+
+def _query_datetime(value: str) -> str:
+    return dt.datetime.fromisoformat(value.rstrip("Z")).strftime(DATETIME_FORMAT)
+
+
+class FakeGraphServer:
+    """
+    An in-memory Graph calendar served over HTTPS on localhost.
+
+    Attributes:
+        latency (float): Seconds added to every request.
+        jitter (float): Up to this many more seconds added at random.
+        throttle_rate (float): Share of Graph requests, and of $batch items, answered with 429.
+        retry_after (float): The Retry-After of throttled responses.
+        stats (dict): Requests served per operation, "throttled" and "unauthorized" responses.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 0.1, seed: Optional[int] = None):
+        """
+        Initializes the FakeGraphServer object.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 for any free port.
+            latency (float): Seconds added to every request.
+            jitter (float): Up to this many more seconds added at random.
+            throttle_rate (float): Share of Graph requests answered with 429.
+            retry_after (float): The Retry-After of throttled responses, in seconds.
+            seed (int): Seed of the latency and throttling randomness.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stats = {}
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._events = {}
+        # event id -> sequence number of its last change; deleted events keep theirs as tombstones
+        self._changes = {}
+        self._removed = set()
+        self._sequence = 0
+        self._tokens = set()
+        self._directory = tempfile.TemporaryDirectory(prefix="fake-graph-")
+        self.ca_bundle, key_path = _self_signed_certificate(self._directory.name)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.ca_bundle, key_path)
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        # handshake in the request thread rather than the accept loop
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True,
+                                                  do_handshake_on_connect=False)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"https://{'localhost' if host in ('127.0.0.1', '0.0.0.0') else host}:{port}"
+
+    @property
+    def graph_endpoint(self) -> str:
+        return self.base_url + GRAPH_PREFIX
+
+    @property
+    def authority_host(self) -> str:
+        return self.base_url
+
+    def configure(self, config: AppConfig, **sections) -> AppConfig:
+        """
+        Returns a copy of a configuration that points O365Client at this server.
+
+        Args:
+            config (AppConfig): The configuration to copy.
+            sections: Further sections to replace, e.g. mirror=MirrorSettings(enabled=False).
+
+        Returns:
+            AppConfig: The copy.
+        """
+        graph = GraphSettings(endpoint=self.graph_endpoint, authority_host=self.authority_host,
+                              ca_bundle=self.ca_bundle)
+        return config.model_copy(update={"graph": graph, **sections})
+
+    def start(self) -> "FakeGraphServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-graph", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._directory.cleanup()
+
+    def __enter__(self) -> "FakeGraphServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def seed_events(self, count: int, start: Optional[dt.datetime] = None, step_hours: int = 5):
+        """
+        Adds events of an hour each, `step_hours` apart, starting at `start` (UTC, by default the next full hour).
+        """
+        start = start or dt.datetime.utcnow().replace(minute=0, second=0, microsecond=0) + dt.timedelta(hours=1)
+        with self._lock:
+            for idx in range(count):
+                begin = start + dt.timedelta(hours=idx * step_hours)
+                self.__store__({"subject": f"Seeded event {idx}",
+                                "start": {"dateTime": begin.isoformat(), "timeZone": "UTC"},
+                                "end": {"dateTime": (begin + dt.timedelta(hours=1)).isoformat(), "timeZone": "UTC"}})
+
+    def event_count(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+    def event_ids(self) -> list:
+        with self._lock:
+            return list(self._events)
+
+    def __count__(self, key: str):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def __throttle__(self) -> Optional[Response]:
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            self.__count__("throttled")
+            error = {"error": {"code": "TooManyRequests", "message": "Please retry again later."}}
+            return 429, {"Retry-After": str(self.retry_after)}, error
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+    def __store__(self, body: dict, event_id: Optional[str] = None) -> dict:
+        # must be called with the lock held
+        event = dict(self._events.get(event_id, {}))
+        event.update({key: value for key, value in body.items() if key != "id"})
+        event["id"] = event_id or uuid.uuid4().hex
+        for key in ("start", "end"):
+            if key in body:
+                event[key] = {"dateTime": _graph_datetime(body[key]), "timeZone": "UTC"}
+        self._sequence += 1
+        self._events[event["id"]] = event
+        self._changes[event["id"]] = self._sequence
+        return event
+
+    def handle_token(self, path: str, headers: dict, body: bytes) -> Response:
+        """
+        Serves the authority: OpenID configuration discovery and client-credentials tokens.
+        """
+        match = _OPENID.match(path)
+        if match:
+            tenant_url = f"{self.authority_host}/{match.group(1)}"
+            return 200, {}, {"issuer": f"{tenant_url}/v2.0",
+                             "authorization_endpoint": f"{tenant_url}/oauth2/v2.0/authorize",
+                             "token_endpoint": f"{tenant_url}/oauth2/v2.0/token",
+                             "device_authorization_endpoint": f"{tenant_url}/oauth2/v2.0/devicecode"}
+        if _TOKEN.match(path):
+            form = parse_qs(body.decode("utf-8"))
+            if form.get("grant_type") != ["client_credentials"] or not form.get("client_id"):
+                return 400, {}, {"error": "unsupported_grant_type"}
+            token = f"fake-{uuid.uuid4().hex}"
+            with self._lock:
+                self._tokens.add(token)
+            self.__count__("token")
+            return 200, {}, {"token_type": "Bearer", "expires_in": TOKEN_LIFETIME, "access_token": token}
+        return 404, {}, {"error": "not_found"}
+
+    def handle_graph(self, method: str, url: str, headers: dict, body: Optional[dict]) -> Response:
+        """
+        Serves a Graph request, given its URL relative to the /v1.0 prefix.
+        """
+        auth = headers.get("Authorization", "") or headers.get("authorization", "")
+        with self._lock:
+            authorized = auth.startswith("Bearer ") and auth[len("Bearer "):] in self._tokens
+        if not authorized:
+            self.__count__("unauthorized")
+            return 401, {}, {"error": {"code": "InvalidAuthenticationToken"}}
+
+        parsed = urlparse(url)
+        path, query = parsed.path, {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        if path == "/$batch" and method == "POST":
+            return self.__batch__(body or {})
+        return self.__throttle__() or self.__dispatch__(method, path, query, body, headers)
+
+    def __dispatch__(self, method: str, path: str, query: dict, body: Optional[dict],
+                     headers: Optional[dict] = None) -> Response:
+        if _EVENTS.match(path):
+            if method == "POST":
+                self.__count__("add")
+                with self._lock:
+                    return 201, {}, self.__store__(body or {})
+            if method == "GET":
+                self.__count__("list")
+                return self.__page__(path, query, start=None, end=None)
+        match = _EVENT.match(path)
+        if match:
+            event_id = match.group(1)
+            with self._lock:
+                if event_id not in self._events:
+                    return 404, {}, {"error": {"code": "ErrorItemNotFound"}}
+                if method == "GET":
+                    return 200, {}, self._events[event_id]
+                if method == "PATCH":
+                    self.__count__("update")
+                    return 200, {}, self.__store__(body or {}, event_id)
+                if method == "DELETE":
+                    self.__count__("delete")
+                    del self._events[event_id]
+                    self._sequence += 1
+                    self._changes[event_id] = self._sequence
+                    self._removed.add(event_id)
+                    return 204, {}, None
+        if _CALENDAR_VIEW.match(path) and method == "GET":
+            self.__count__("calendarView")
+            if "startDateTime" not in query or "endDateTime" not in query:
+                return 400, {}, {"error": {"code": "ErrorInvalidParameter"}}
+            return self.__page__(path, query, _query_datetime(query["startDateTime"]),
+                                 _query_datetime(query["endDateTime"]))
+        if _CALENDAR_DELTA.match(path) and method == "GET":
+            self.__count__("delta")
+            return self.__delta__(path, query, headers)
+        return 405 if path.startswith("/users/") else 404, {}, {"error": {"code": "BadRequest"}}
+
+    def __page__(self, path: str, query: dict, start: Optional[str], end: Optional[str]) -> Response:
+        top = int(query.get("$top", DEFAULT_PAGE_SIZE))
+        skip = int(query.get("$skip", 0))
+        with self._lock:
+            events = [event for event in self._events.values()
+                      if start is None or (event["end"]["dateTime"] > start and event["start"]["dateTime"] < end)]
+        events.sort(key=lambda event: (event["start"]["dateTime"], event["id"]))
+        select = query.get("$select")
+        page = events[skip:skip + top]
+        if select:
+            fields = select.split(",")
+            page = [{key: event[key] for key in fields if key in event} for event in page]
+        response = {"value": page}
+        if skip + top < len(events):
+            response["@odata.nextLink"] = self.graph_endpoint + path + "?" + urlencode({**query, "$skip": skip + top})
+        return 200, {}, response
+
+    def __delta__(self, path: str, query: dict, headers: Optional[dict]) -> Response:
+        if "$deltatoken" in query:
+            since = int(query["$deltatoken"])
+            start, end = _query_datetime(query["startDateTime"]), _query_datetime(query["endDateTime"])
+            with self._lock:
+                changed = [event_id for event_id, sequence in self._changes.items() if sequence > since]
+                value = [{"id": event_id, "@removed": {"reason": "deleted"}} if event_id in self._removed
+                         else self._events[event_id] for event_id in changed]
+                sequence = self._sequence
+            value = [event for event in value if "@removed" in event
+                     or (event["end"]["dateTime"] > start and event["start"]["dateTime"] < end)]
+            link = urlencode({"startDateTime": query["startDateTime"], "endDateTime": query["endDateTime"],
+                              "$deltatoken": sequence})
+            return 200, {}, {"value": value, "@odata.deltaLink": f"{self.graph_endpoint}{path}?{link}"}
+
+        with self._lock:
+            sequence = self._sequence
+        # delta queries are paged by the odata.maxpagesize preference rather than $top
+        prefer = re.search(r"odata\.maxpagesize=(\d+)", (headers or {}).get("Prefer", ""))
+        page_query = {**query, "$top": prefer.group(1) if prefer else query.get("$top", DEFAULT_PAGE_SIZE)}
+        status, headers, page = self.__page__(path, page_query, _query_datetime(query["startDateTime"]),
+                                              _query_datetime(query["endDateTime"]))
+        if "@odata.nextLink" not in page:
+            link = urlencode({"startDateTime": query["startDateTime"], "endDateTime": query["endDateTime"],
+                              "$deltatoken": sequence})
+            page["@odata.deltaLink"] = f"{self.graph_endpoint}{path}?{link}"
+        return status, headers, page
+
+    def __batch__(self, body: dict) -> Response:
+        self.__count__("batch")
+        requests = body.get("requests", [])
+        if len(requests) > 20:
+            return 400, {}, {"error": {"code": "BadRequest", "message": "Too many requests in the batch."}}
+        statuses, responses = {}, []
+        for request in requests:
+            failed = [dep for dep in request.get("dependsOn", []) if not 200 <= statuses.get(dep, 424) < 300]
+            if failed:
+                status, item_headers, item_body = 424, {}, {"error": {"code": "FailedDependency"}}
+            else:
+                parsed = urlparse(request["url"])
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                status, item_headers, item_body = self.__throttle__() or self.__dispatch__(
+                    request["method"], parsed.path, query, request.get("body"))
+            statuses[request["id"]] = status
+            item = {"id": request["id"], "status": status, "headers": item_headers}
+            if item_body is not None:
+                item["body"] = item_body
+            responses.append(item)
+        return 200, {}, {"responses": responses}
+
+
+def _make_handler(server: FakeGraphServer):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately; without TCP_NODELAY the body waits for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def __respond__(self, response: Response):
+            status, headers, body = response
+            payload = json.dumps(body).encode("utf-8") if body is not None else b""
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            if body is not None:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def __serve__(self, method: str):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            server.delay()
+            if self.path.startswith(GRAPH_PREFIX + "/"):
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    return self.__respond__((400, {}, {"error": {"code": "BadRequest"}}))
+                return self.__respond__(server.handle_graph(method, self.path[len(GRAPH_PREFIX):],
+                                                            dict(self.headers), body))
+            self.__respond__(server.handle_token(urlparse(self.path).path, dict(self.headers), raw))
+
+        def do_GET(self):
+            self.__serve__("GET")
+
+        def do_POST(self):
+            self.__serve__("POST")
+
+        def do_PATCH(self):
+            self.__serve__("PATCH")
+
+        def do_DELETE(self):
+            self.__serve__("DELETE")
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Microsoft Graph calendar API")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds at random")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of throttled responses")
+    parser.add_argument("--events", type=int, default=50, help="events seeded into the calendar")
+    args = parser.parse_args()
+
+    server = FakeGraphServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                             throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    server.seed_events(args.events)
+    print("Point the app at the stand-in server with:")
+    print(f"GRAPH_ENDPOINT={server.graph_endpoint}")
+    print(f"GRAPH_AUTHORITY_HOST={server.authority_host}")
+    print(f"GRAPH_CA_BUNDLE={server.ca_bundle}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
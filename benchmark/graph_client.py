@@ -0,0 +1,142 @@
+"""
+Benchmark of O365Client against the local Graph stand-in in benchmark.fake_graph.
+
+Every operation of the client is called `iterations` times from `concurrency` threads, the way the chat flow
+and the parallel ODSL executor call it, and reported as ops/s and p50/p95/p99 latency:
+- add, update and delete of single events,
+- list of the next 20 events from Graph and from the calendar mirror,
+- iterate over the whole calendar page by page,
+- batch of 10 adds through $batch.
+Latency and throttling of the stand-in can be injected to see how the client copes.
+
+    python -m benchmark.graph_client [--iterations 200] [--concurrency 4] [--latency 0.01] [--throttle-rate 0.05]
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List
+from benchmark.fake_graph import FakeGraphServer
+from module.app_config import MirrorSettings, get_config
+from module.office_client_v2 import O365Client
+
+OPERATIONS = ['add', 'update', 'delete', 'list', 'list_mirror', 'iterate', 'batch']
+BATCH_SIZE = 10
+
+
+def percentile(timings: List[float], q: float) -> float:
+    """
+    Returns the q-th percentile of the timings, by the nearest-rank method.
+
+    :param timings: The sorted timings.
+    :param q: The percentile, between 0 and 100.
+    :return: The percentile.
+    """
+    rank = max(int(round(q / 100 * len(timings) + 0.5)) - 1, 0)
+    return timings[min(rank, len(timings) - 1)]
+
+
+def _operation(name: str, client: O365Client, mirror_client: O365Client, event_ids: List[str]) -> Callable:
+    # returns a callable that performs the operation once, given the iteration number
+    start = datetime.utcnow() + timedelta(days=1)
+    if name == 'add':
+        return lambda i: client.outlook_event_add(f'Benchmark {i}', start, start + timedelta(hours=1))
+    if name == 'update':
+        return lambda i: client.outlook_event_update(event_ids[i % len(event_ids)], f'Updated {i}',
+                                                     start, start + timedelta(hours=1))
+    if name == 'delete':
+        return lambda i: client.outlook_event_delete(event_ids.pop())
+    if name == 'list':
+        return lambda i: client.outlook_event_list(start=datetime.utcnow(), top=20)
+    if name == 'list_mirror':
+        return lambda i: mirror_client.outlook_event_list(start=datetime.utcnow(), top=20)
+    if name == 'iterate':
+        return lambda i: sum(1 for _ in client.iter_outlook_events(page_size=50))
+    if name == 'batch':
+        operations = [{'method': 'add', 'subject': f'Batched {n}', 'start_time': start,
+                       'end_time': start + timedelta(hours=1)} for n in range(BATCH_SIZE)]
+        return lambda i: client.outlook_event_batch(operations)
+    raise ValueError(f'Unknown operation: {name}')
+
+
+def run(name: str, call: Callable, iterations: int, concurrency: int) -> dict:
+    """
+    Calls an operation `iterations` times on `concurrency` threads.
+
+    :param name: The name of the operation.
+    :param call: The operation, called with the iteration number.
+    :param iterations: The number of calls.
+    :param concurrency: The number of threads calling.
+    :return: The name, ops/s, latency percentiles in milliseconds and the number of errors.
+    """
+    def timed(i: int):
+        begin = time.perf_counter()
+        try:
+            call(i)
+            return time.perf_counter() - begin, None
+        except Exception as e:
+            return time.perf_counter() - begin, e
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    timings = sorted(timing for timing, _ in outcomes)
+    errors = [error for _, error in outcomes if error is not None]
+    if errors:
+        print(f'{name}: {len(errors)} errors, first: {errors[0]!r}')
+    return {'operation': name, 'ops_per_sec': iterations / elapsed,
+            'p50_ms': percentile(timings, 50) * 1e3, 'p95_ms': percentile(timings, 95) * 1e3,
+            'p99_ms': percentile(timings, 99) * 1e3, 'errors': len(errors)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='O365Client benchmark against a local Graph stand-in')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--events', type=int, default=200, help='events in the calendar before the run')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in adds to every request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=0.05)
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--json', action='store_true', help='print the results as JSON lines')
+    args = parser.parse_args(argv)
+
+    with FakeGraphServer(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                         retry_after=args.retry_after, seed=7) as server:
+        # events the updates and deletes work on
+        server.seed_events(args.events + args.iterations)
+        event_ids = server.event_ids()
+        base = get_config()
+        client = O365Client(server.configure(base, mirror=MirrorSettings(enabled=False)))
+        mirror_client = O365Client(server.configure(base, mirror=MirrorSettings(enabled=True, path=':memory:')))
+        # acquire the token, connect and fill the mirror outside the measurements
+        mirror_client.outlook_event_list(start=datetime.utcnow(), top=1)
+
+        results = []
+        for name in args.operations.split(','):
+            results.append(run(name, _operation(name, client, mirror_client, event_ids),
+                               args.iterations, args.concurrency))
+
+        if args.json:
+            for result in results:
+                print(json.dumps(result))
+        else:
+            print(f'O365Client against the Graph stand-in: {args.iterations} calls per operation, '
+                  f'{args.concurrency} threads, latency {args.latency * 1e3:.0f} ms, '
+                  f'throttle rate {args.throttle_rate:.0%}')
+            print(f'{"operation":<12} {"ops/s":>9} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}')
+            for r in results:
+                print(f'{r["operation"]:<12} {r["ops_per_sec"]:9.1f} {r["p50_ms"]:9.2f} {r["p95_ms"]:9.2f} '
+                      f'{r["p99_ms"]:9.2f} {r["errors"]:7d}')
+            print(f'server {server.stats}')
+            print(f'client {client.connection_stats()} {client.retry_stats()}')
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Micro-benchmark for ODSL parsing.
+
+Compares the per-call latency of
+- compiling the textX meta-model on every call (the original behaviour of generate_odsl_execute),
+- the cached textX meta-model returned by get_metamodel,
+- the hand-written fast-path parser in odsl_parser.
+
+Before timing, the fast path is checked against textX on a conformance corpus: every input the fast
+path accepts must produce the same commands and attributes as textX, and every input it rejects must
+fall back to textX. The corpus is a fixed list of edge cases plus seeded random call forms.
+
+    python -m benchmark.odsl_parse [iterations]
+"""
+import random
+import sys
+import time
+from statistics import mean, median
+from textx import metamodel_from_file
+from module import odsl_parser
+from module.odsl_interpreter import ODSL_MODEL_PATH, get_metamodel
+
+SAMPLE_SCRIPT = 'modify_outlook_schedule("5678", "Updated Project Meeting", "2023-11-16 09:00:00", "2023-11-16 10:00:00")'
+
+CONFORMANCE_CASES = [
+    '',
+    '   \n',
+    SAMPLE_SCRIPT,
+    'add_outlook_schedule("Project Meeting", "2023-11-16 09:00:00", "2023-11-16 10:00:00")',
+    'add_outlook_schedule("Lunch, then review", "YYYY-MM-DD 12:00:00", "YYYY-MM-DD 13:00:00")',
+    "add_outlook_schedule('Single quoted', '2023-11-16 09:00:00', '2023-11-16 10:00:00')",
+    'add_outlook_schedule("Say \\"hi\\"", "2023-11-16 09:00:00", "2023-11-16 10:00:00")',
+    "add_outlook_schedule('It\\'s late', \"a\\'b\", 'c\"d')",
+    'add_outlook_schedule("Trailing backslash \\\\", "x", "y")',
+    'add_outlook_schedule ( "Spaced" ,\n\t"2023-11-16 09:00:00" ,"2023-11-16 10:00:00" )  ',
+    'remove_outlook_schedule("AAMkAGI2TG93AAA=")',
+    'remove_outlook_schedule("1")\nremove_outlook_schedule("2")\nmodify_outlook_schedule("3", "d", "s", "e")',
+    'list_outlook_schedule()',
+    'list_outlook_schedule ( )',
+    'remove_outlook_schedule("")',
+    'add_outlook_schedule("Multi\nline", "s", "e")',
+    # rejected by both parsers
+    '`remove_outlook_schedule("5678")`',
+    'remove_outlook_schedule(5678)',
+    'remove_outlook_schedule("5678"',
+    'remove_outlook_schedule("1", "2")',
+    'add_outlook_schedule("a", "b")',
+    'remove_outlook_schedulex("1")',
+    'delete_outlook_schedule("1")',
+    'Sure! remove_outlook_schedule("1")',
+    'remove_outlook_schedule("unterminated)',
+]
+
+
+def _fuzz_cases(count: int, seed: int = 7) -> list:
+    # random call forms built from quote, escape, separator and whitespace fragments
+    rng = random.Random(seed)
+    fragments = ['"', "'", '\\', '\\"', "\\'", ',', ' ', '\n', 'a', '(', ')', '2023-11-16 09:00:00']
+    names = list(odsl_parser.COMMAND_NODES) + ['list_outlook_schedule']
+    cases = []
+    for _ in range(count):
+        args = ''.join(rng.choice(fragments) for _ in range(rng.randint(0, 12)))
+        cases.append(f'{rng.choice(names)}({args})')
+    return cases
+
+
+def _textx_parse(script_str: str):
+    try:
+        return odsl_parser.model_signature(get_metamodel().model_from_str(script_str))
+    except Exception:
+        return None
+
+
+def _fast_parse(script_str: str):
+    try:
+        return odsl_parser.model_signature(odsl_parser.parse(script_str))
+    except odsl_parser.ODSLSyntaxError:
+        return None
+
+
+def check_conformance() -> int:
+    """
+    Compares both parsers on CONFORMANCE_CASES and prints every mismatch.
+
+    :return: The number of mismatching cases.
+    """
+    failures = 0
+    cases = CONFORMANCE_CASES + _fuzz_cases(2000)
+    for case in cases:
+        expected = _textx_parse(case)
+        actual = _fast_parse(case)
+        # a fast-path rejection is fine as long as the fallback gets to decide
+        if actual is not None and actual != expected:
+            failures += 1
+            print(f'MISMATCH {case!r}\n  textX: {expected}\n  fast : {actual}')
+    print(f'conformance: {len(cases) - failures}/{len(cases)} cases agree')
+    return failures
+
+
+def _measure(parse, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        parse(SAMPLE_SCRIPT)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _report(label: str, timings: list):
+    print(f'{label:<10} mean {mean(timings) * 1e6:10.1f} us   median {median(timings) * 1e6:10.1f} us')
+
+
+def main(iterations: int = 200) -> int:
+    failures = check_conformance()
+
+    uncached = _measure(lambda s: metamodel_from_file(ODSL_MODEL_PATH).model_from_str(s), iterations)
+    get_metamodel()
+    cached = _measure(lambda s: get_metamodel().model_from_str(s), iterations)
+    fast = _measure(odsl_parser.parse, iterations)
+
+    print(f'ODSL parse latency over {iterations} calls')
+    _report('uncached', uncached)
+    _report('cached', cached)
+    _report('fast', fast)
+    print(f'speed-up   cached x{mean(uncached) / mean(cached):.1f}   fast x{mean(uncached) / mean(fast):.1f}')
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 200) else 0)
@@ -0,0 +1,293 @@
+"""
+This module contains the process-wide application configuration.
+get_config merges settings.cfg, settings.dev.cfg (when PROD_DEV=DEV) and the environment, including .env, into one
+validated AppConfig. It is loaded once and only re-read when one of those files changes on disk, so getting the
+configuration is cheap enough to do on every request, and invalid settings fail at startup instead of mid-request.
+Every field can be overridden by an environment variable named <SECTION>_<FIELD>, e.g. HTTP_POOL_SIZE=20.
+"""
+import logging
+import os
+import threading
+import time
+from configparser import ConfigParser, Error as ConfigParserError
+from typing import Dict, List, Optional
+from dotenv import dotenv_values
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from module.enum_type import ExecutionMode, GeneratePrompt
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTINGS_PATH = os.path.join(ROOT_DIR, "settings.cfg")
+DEV_SETTINGS_PATH = os.path.join(ROOT_DIR, "settings.dev.cfg")
+DOTENV_PATH = os.path.join(ROOT_DIR, ".env")
+GRAPH_ENDPOINT = "https://graph.microsoft.com/v1.0"
+AUTHORITY_HOST = "https://login.microsoftonline.com"
+# Seconds between two checks of the source files' mtimes
+RELOAD_CHECK_INTERVAL = 1.0
+
+# environment variables that predate the <SECTION>_<FIELD> naming
+ENV_ALIASES = {
+    ("azure_openai", "endpoint"): ["AZURE_OPEN_AI_ENDPOINT"],
+    ("azure_openai", "api_key"): ["AZURE_OPEN_AI_KEY"],
+    ("azure_openai", "api_version"): ["AZURE_OPENAI_API_VERSION_CHAT"],
+}
+
+
+class ConfigError(Exception):
+    """
+    Raised when the configuration cannot be read or is invalid.
+    """
+
+
+class _Section(BaseModel):
+    # settings.cfg sections repeat interpolation helpers such as tenant_prefix
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+
+class GraphSettings(_Section):
+    endpoint: str = Field(GRAPH_ENDPOINT, pattern=r"^https?://")
+    authority_host: str = Field(AUTHORITY_HOST, pattern=r"^https://")
+    # CA bundle trusted for both hosts, e.g. the certificate of a local stand-in server
+    ca_bundle: Optional[str] = None
+
+
+class DefaultSettings(_Section):
+    tenant: str = Field(..., min_length=1)
+
+
+class UserCredentials(_Section):
+    username: str = Field(..., min_length=1)
+    password: str = ""
+
+
+class ClientCredentials(_Section):
+    client_id: str = Field(..., min_length=1)
+    client_secret: str = Field(..., min_length=1)
+
+
+class TokenCacheSettings(_Section):
+    path: Optional[str] = None
+    refresh_margin: int = Field(600, ge=0)
+
+
+class HttpSettings(_Section):
+    pool_size: int = Field(10, ge=1)
+    timeout: float = Field(30, gt=0)
+
+
+class RetrySettings(_Section):
+    max_retries: int = Field(5, ge=0)
+    base_delay: float = Field(0.5, ge=0)
+    max_delay: float = Field(30, ge=0)
+
+
+class MirrorSettings(_Section):
+    enabled: bool = False
+    path: str = "calendar_mirror.db"
+    past_days: int = Field(30, ge=0)
+    future_days: int = Field(400, ge=1)
+    sync_interval: float = Field(30, ge=0)
+
+
+class OdslSettings(_Section):
+    execution_mode: ExecutionMode = ExecutionMode.BATCH
+    max_concurrency: int = Field(4, ge=1)
+
+
+class IntentSettings(_Section):
+    enabled: bool = True
+    threshold: float = Field(0.9, ge=0, le=1)
+    examples_path: Optional[str] = "intent_examples.jsonl"
+    min_examples: int = Field(50, ge=0)
+    # one LLM call returning intent and ODSL when the intent is not decided locally
+    combined: bool = True
+    # detect the intent while the ODSL reply and the schedule list are fetched speculatively
+    pipelined: bool = False
+
+
+class HistorySettings(_Section):
+    max_tokens: int = Field(2000, ge=1)
+    # append-only audit log of every conversation
+    log_path: Optional[str] = None
+
+
+class CompletionCacheSettings(_Section):
+    enabled: bool = True
+    # prompt types whose completions are cached, comma separated in settings.cfg
+    prompt_types: List[GeneratePrompt] = [GeneratePrompt.INTENT]
+    max_entries: int = Field(1000, ge=1)
+    ttl: float = Field(3600, ge=0)
+    path: Optional[str] = None
+
+    @field_validator("prompt_types", mode="before")
+    @classmethod
+    def split_prompt_types(cls, value):
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(",") if item.strip()]
+        return value
+
+
+class SessionSettings(_Section):
+    idle_timeout: float = Field(1800, gt=0)
+    max_sessions: int = Field(100, ge=1)
+    max_in_flight: int = Field(1, ge=1)
+    max_history: int = Field(50, ge=1)
+
+
+class ApiSettings(_Section):
+    workers: int = Field(8, ge=1)
+    max_queue: int = Field(32, ge=0)
+    max_body: int = Field(65536, ge=1)
+
+
+class AzureOpenAISettings(_Section):
+    endpoint: Optional[str] = None
+    api_key: Optional[str] = None
+    api_version: Optional[str] = None
+    deployment_name: Optional[str] = None
+
+
+class AppConfig(_Section):
+    """
+    The validated configuration of the application, one attribute per settings.cfg section.
+    """
+    default: DefaultSettings
+    user_credentials: UserCredentials
+    client_credentials: ClientCredentials
+    graph: GraphSettings = GraphSettings()
+    token_cache: TokenCacheSettings = TokenCacheSettings()
+    http: HttpSettings = HttpSettings()
+    retry: RetrySettings = RetrySettings()
+    mirror: MirrorSettings = MirrorSettings()
+    odsl: OdslSettings = OdslSettings()
+    intent: IntentSettings = IntentSettings()
+    history: HistorySettings = HistorySettings()
+    completion_cache: CompletionCacheSettings = CompletionCacheSettings()
+    sessions: SessionSettings = SessionSettings()
+    api: ApiSettings = ApiSettings()
+    azure_openai: AzureOpenAISettings = AzureOpenAISettings()
+
+    def resolve_path(self, path: str) -> str:
+        """
+        Resolves a configured file path relative to the repository root.
+        """
+        if path == ":memory:" or os.path.isabs(path):
+            return path
+        return os.path.join(ROOT_DIR, path)
+
+
+def _source_files(environ: Dict[str, str]) -> List[str]:
+    files = [SETTINGS_PATH]
+    if environ.get("PROD_DEV") == "DEV":
+        files.append(DEV_SETTINGS_PATH)
+    return files
+
+
+def _environment() -> Dict[str, str]:
+    # the process environment takes precedence over .env, as with load_dotenv
+    environ = {key: value for key, value in dotenv_values(DOTENV_PATH).items() if value is not None} \
+        if os.path.exists(DOTENV_PATH) else {}
+    environ.update(os.environ)
+    return environ
+
+
+def load_config(environ: Optional[Dict[str, str]] = None) -> AppConfig:
+    """
+    Reads and validates the configuration.
+
+    Args:
+        environ (dict): The environment variables, the process environment merged with .env by default.
+
+    Returns:
+        AppConfig: The configuration.
+
+    Raises:
+        ConfigError: If a settings file cannot be parsed or a value is missing or invalid.
+    """
+    environ = _environment() if environ is None else environ
+    cp = ConfigParser()
+    try:
+        # settings.dev.cfg overrides settings.cfg section by section
+        cp.read(_source_files(environ), encoding="utf-8")
+        data = {section: dict(cp.items(section)) for section in cp.sections()}
+    except ConfigParserError as e:
+        raise ConfigError(f"Failed to read settings: {e}")
+
+    for section, model in AppConfig.model_fields.items():
+        for field in model.annotation.model_fields:
+            names = [f"{section}_{field}".upper()] + ENV_ALIASES.get((section, field), [])
+            value = next((environ[name] for name in names if environ.get(name)), None)
+            if value is not None:
+                data.setdefault(section, {})[field] = value
+    for section, field in (("token_cache", "path"), ("graph", "ca_bundle"), ("intent", "examples_path"),
+                           ("completion_cache", "path"), ("history", "log_path")):
+        if data.get(section, {}).get(field) == "":
+            data[section][field] = None
+
+    try:
+        return AppConfig.model_validate(data)
+    except ValidationError as e:
+        raise ConfigError(f"Invalid settings: {e}")
+
+
+class _ConfigState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.config: Optional[AppConfig] = None
+        self.mtimes: Optional[tuple] = None
+        self.checked_at = 0.0
+
+
+_state = _ConfigState()
+
+
+def _mtimes() -> tuple:
+    paths = [SETTINGS_PATH, DEV_SETTINGS_PATH, DOTENV_PATH]
+    return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+
+
+def get_config() -> AppConfig:
+    """
+    Returns the shared configuration, loading it on first use and reloading it when a source file changed.
+    A reload that fails validation is logged and the previous configuration is kept.
+
+    Returns:
+        AppConfig: The configuration.
+
+    Raises:
+        ConfigError: If the first load fails.
+    """
+    config, now = _state.config, time.monotonic()
+    if config is not None and now - _state.checked_at < RELOAD_CHECK_INTERVAL:
+        return config
+    with _state.lock:
+        _state.checked_at = now
+        mtimes = _mtimes()
+        if _state.config is not None and mtimes == _state.mtimes:
+            return _state.config
+        try:
+            _state.config = load_config()
+            logging.info('<get_config>:settings loaded')
+        except ConfigError as e:
+            if _state.config is None:
+                raise
+            logging.error(f'<get_config>:keeping the previous settings: {e}')
+        _state.mtimes = mtimes
+        return _state.config
+
+
+def set_config(config: Optional[AppConfig]) -> Optional[AppConfig]:
+    """
+    Replaces the shared configuration, e.g. in tests; None loads it from the files again on next use.
+
+    Args:
+        config (AppConfig): The configuration to share.
+
+    Returns:
+        AppConfig: The previously shared configuration.
+    """
+    with _state.lock:
+        previous, _state.config = _state.config, config
+        # a replaced configuration is kept until the source files change
+        _state.mtimes = _mtimes() if config is not None else None
+        _state.checked_at = time.monotonic()
+    return previous
@@ -0,0 +1,257 @@
+"""
+This module contains the local calendar mirror used by O365Client.
+CalendarMirror keeps the events of a fixed window around today in SQLite and brings them up to date with
+Graph calendarView delta queries, so listing schedules becomes a local query plus a cheap incremental sync.
+The delta link is stored next to the events, so the mirror survives restarts without a full enumeration.
+Writes made through O365Client are applied to the mirror optimistically, before the next sync confirms them.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+DEFAULT_PAST_DAYS = 30
+DEFAULT_FUTURE_DAYS = 400
+# The window is enumerated again once it ends this many days earlier than a freshly started one would.
+MAX_DRIFT_DAYS = 7
+# Minimum seconds between two delta syncs; reads in between are served from the mirror as is.
+DEFAULT_SYNC_INTERVAL = 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    subject TEXT,
+    start TEXT NOT NULL,
+    "end" TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def _graph_datetime(value: datetime) -> str:
+    # the format Graph returns dateTime values in, which sorts chronologically
+    return value.strftime('%Y-%m-%dT%H:%M:%S.0000000')
+
+
+class CalendarMirror:
+    """
+    A SQLite mirror of one user's calendar window.
+
+    Attributes:
+        path (str): The SQLite database file.
+    """
+
+    def __init__(self, path: str, past_days: int = DEFAULT_PAST_DAYS, future_days: int = DEFAULT_FUTURE_DAYS,
+                 sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        """
+        Initializes the CalendarMirror object.
+
+        Args:
+            path (str): The SQLite database file, ":memory:" for a non-persistent mirror.
+            past_days (int): Days before today covered by the mirror.
+            future_days (int): Days after today covered by the mirror.
+            sync_interval (float): Minimum seconds between two delta syncs.
+        """
+        self.path = path
+        self.past_days = past_days
+        self.future_days = future_days
+        self.sync_interval = sync_interval
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._last_sync = 0.0
+        # whether the last sync of this process completed; a mirror left by an earlier run is not served before that
+        self._synced = False
+
+    def __get_meta__(self, key: str) -> Optional[str]:
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def __set_meta__(self, key: str, value: Optional[str]):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def window(self) -> Optional[tuple]:
+        """
+        Returns the (start, end) of the mirrored window, or None before the first sync.
+        """
+        with self._lock:
+            start, end = self.__get_meta__('window_start'), self.__get_meta__('window_end')
+        if start is None or end is None:
+            return None
+        return datetime.fromisoformat(start), datetime.fromisoformat(end)
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        """
+        Checks whether a listing window can be served from the mirror, which requires that the last sync completed.
+        Between syncs, i.e. within sync_interval, the mirror is served as is.
+        """
+        if not self._synced:
+            return False
+        window = self.window()
+        return window is not None and window[0] <= start and end <= window[1]
+
+    def reset(self):
+        """
+        Drops the mirrored events and the delta link; the next sync enumerates a new window.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM events')
+            self._conn.execute('DELETE FROM meta')
+        self._last_sync = 0.0
+        self._synced = False
+
+    async def sync(self, fetch: Callable[[str, Optional[dict]], Awaitable[dict]], delta_url: str,
+                   force: bool = False):
+        """
+        Applies the changes since the last sync, or enumerates the window on the first sync.
+
+        Pages are fetched without holding the lock and applied in a single transaction.
+
+        Args:
+            fetch (callable): Coroutine function that GETs a Graph URL with optional query parameters
+                and returns the JSON body.
+            delta_url (str): The calendarView/delta URL of the user's calendar.
+            force (bool): Sync even if the last sync is more recent than sync_interval.
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._last_sync < self.sync_interval:
+                return
+            # claim this sync, so concurrent readers are served from the mirror meanwhile
+            self._last_sync = time.monotonic()
+
+            window = self.window()
+            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+            drifted = window is not None and today + timedelta(days=self.future_days - MAX_DRIFT_DAYS) > window[1]
+            if drifted or self.__get_meta__('delta_url') not in (None, delta_url):
+                # the window fell behind today, or the mirror belongs to another calendar: start over
+                self.reset()
+                window = None
+
+            url, params = self.__get_meta__('delta_link'), None
+            if url is None:
+                window = (today - timedelta(days=self.past_days), today + timedelta(days=self.future_days))
+                url = delta_url
+                params = {'startDateTime': window[0].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                          'endDateTime': window[1].strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+        resuming = params is None
+        pages = []
+        try:
+            while url:
+                page = await fetch(url, params)
+                # next and delta links already carry the query
+                params = None
+                pages.append(page)
+                url = page.get('@odata.nextLink')
+        except Exception as e:
+            # stale until a sync completes again
+            self._last_sync = 0.0
+            self._synced = False
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if status != 410 or pages or not resuming:
+                raise
+            # 410 Gone: the delta link expired, enumerate again
+            logging.info('<CalendarMirror.sync>:delta link expired, resyncing')
+            self.reset()
+            return await self.sync(fetch, delta_url, force=True)
+
+        with self._lock:
+            changes = self.__apply_delta__(pages, window, delta_url)
+            self._synced = True
+        logging.info(f'<CalendarMirror.sync>:{changes} changes')
+
+    def __apply_delta__(self, pages: List[dict], window: tuple, delta_url: str) -> int:
+        changes = 0
+        with self._conn:
+            for page in pages:
+                for event in page.get('value', []):
+                    changes += 1
+                    if '@removed' in event:
+                        self._conn.execute('DELETE FROM events WHERE id = ?', (event['id'],))
+                    else:
+                        self.__upsert__(event['id'], event.get('subject'),
+                                        event['start']['dateTime'], event['end']['dateTime'])
+                if '@odata.deltaLink' in page:
+                    self.__set_meta__('delta_link', page['@odata.deltaLink'])
+                    self.__set_meta__('window_start', window[0].isoformat())
+                    self.__set_meta__('window_end', window[1].isoformat())
+                    self.__set_meta__('delta_url', delta_url)
+        return changes
+
+    def __upsert__(self, event_id: str, subject: Optional[str], start: str, end: str):
+        self._conn.execute('INSERT OR REPLACE INTO events (id, subject, start, "end") VALUES (?, ?, ?, ?)',
+                           (event_id, subject, start, end))
+
+    def list_events(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    top: Optional[int] = None) -> List[dict]:
+        """
+        Lists mirrored events overlapping a window, ordered by start time.
+
+        Returns:
+            list: The same dictionaries as O365Client.outlook_event_list.
+        """
+        query = 'SELECT id, subject, start, "end" FROM events'
+        conditions, args = [], []
+        if start is not None:
+            conditions.append('"end" > ?')
+            args.append(_graph_datetime(start))
+        if end is not None:
+            conditions.append('start < ?')
+            args.append(_graph_datetime(end))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY start, id'
+        if top:
+            query += ' LIMIT ?'
+            args.append(top)
+
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [{"no": str(idx), "id": row[0], "subject": row[1], "start": row[2], "end": row[3]}
+                for idx, row in enumerate(rows)]
+
+    def apply_write(self, event_id: str, subject: Optional[str] = None,
+                    start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+                    deleted: bool = False):
+        """
+        Applies a write made through Graph to the mirror ahead of the next sync.
+
+        Args:
+            event_id (str): The id of the written event.
+            subject (str): The subject of an added or updated event.
+            start_time (datetime): The start of an added or updated event (UTC).
+            end_time (datetime): The end of an added or updated event (UTC).
+            deleted (bool): Whether the event was deleted.
+        """
+        with self._lock, self._conn:
+            if deleted:
+                self._conn.execute('DELETE FROM events WHERE id = ?', (event_id,))
+            else:
+                self.__upsert__(event_id, subject, _graph_datetime(start_time), _graph_datetime(end_time))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# database path -> CalendarMirror, shared by every O365Client in the process
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_calendar_mirror(path: str, past_days: int = DEFAULT_PAST_DAYS, future_days: int = DEFAULT_FUTURE_DAYS,
+                        sync_interval: float = DEFAULT_SYNC_INTERVAL) -> CalendarMirror:
+    """
+    Returns the process-wide mirror stored at a path, creating it on first use.
+    """
+    with _mirrors_lock:
+        mirror = _mirrors.get(path)
+        if mirror is None:
+            mirror = _mirrors[path] = CalendarMirror(path, past_days, future_days, sync_interval)
+        return mirror
@@ -0,0 +1,380 @@
+"""
+This module contains ChatAPI, a dependency-free ASGI application serving the chatbot to programmatic clients.
+Sessions come from a SessionPool, as in the Streamlit app, and every chatbot call runs on a bounded WorkerPool.
+Calls beyond [api] workers wait in its queue; once max_queue calls are waiting, requests are answered with 503 and a
+Retry-After header, so a burst is pushed back to the load balancer instead of piling up threads.
+
+    POST   /sessions                  -> {"session_id"}
+    DELETE /sessions/{id}
+    POST   /sessions/{id}/messages    {"message", "stream", "dry_run"} -> {"reply", "plan", "results"}, or server-sent events
+    GET    /sessions/{id}/schedules   -> {"reply", "schedules"}
+    POST   /sessions/{id}/odsl        {"script", "dry_run"} -> {"commands", "plan", "results"}
+    GET    /health                    -> the worker and session pool counters
+
+A streamed reply is sent as "delta" events with the text to append, a "reset" event when the reply starts over,
+and a final "done" event with the reply, or an "error" event.
+Sessions are created with POST /sessions; other ids, including removed and evicted sessions, get 404.
+The ODSL endpoint only resolves a schedule_id that is a schedule number of the last listing, e.g. "4" or "No.4";
+any other value is sent to Graph as a schedule id.
+When some commands of a reply fail, the response, or the "error" event, has the "error", "plan" and the "results" of
+every command instead of the reply.
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Optional
+from uuid import uuid4 as uuid
+from textx.exceptions import TextXSyntaxError
+from module.app_config import get_config
+from module.chat_flow import ChatBot
+from module.method_util import get_func_list
+from module.odsl_interpreter import ODSLExecutionError, warm_metamodel
+from module.session_pool import SessionBusyError, SessionNotFoundError, SessionPool
+
+# seconds a client is asked to wait when the queue is full
+RETRY_AFTER = 1
+
+
+class QueueFullError(Exception):
+    """
+    Raised when [api] workers calls run and max_queue calls wait already.
+    """
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: tuple = ()):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+class WorkerPool:
+    """
+    Runs blocking chatbot calls on a bounded thread pool, admitting at most workers + max_queue calls at a time.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        """
+        Initializes the WorkerPool object.
+
+        Args:
+            workers (int): The threads running calls.
+            max_queue (int): The calls allowed to wait for a thread.
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-api')
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._stats = {"completed": 0, "rejected": 0}
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds a place in the pool for the duration of a request.
+
+        Raises:
+            QueueFullError: If the pool and its queue are full.
+        """
+        with self._lock:
+            if self._admitted >= self.workers + self.max_queue:
+                self._stats["rejected"] += 1
+                raise QueueFullError('Too many requests in flight')
+            self._admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._admitted -= 1
+                self._stats["completed"] += 1
+
+    async def run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """
+        Returns the pool counters.
+
+        Returns:
+            dict: The "running" and "queued" requests, and the requests "completed" and "rejected" since the start.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["running"] = min(self._admitted, self.workers)
+            stats["queued"] = max(self._admitted - self.workers, 0)
+        return stats
+
+
+async def _read_json(receive, max_body: int) -> dict:
+    body, more = b'', True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise _HttpError(400, 'Client disconnected')
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+        if len(body) > max_body:
+            raise _HttpError(413, 'Request body too large')
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        raise _HttpError(400, 'Request body is not valid JSON')
+    if not isinstance(data, dict):
+        raise _HttpError(400, 'Request body must be a JSON object')
+    return data
+
+
+async def _send_json(send, status: int, body: dict, headers: tuple = ()):
+    payload = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(payload)).encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+def _sse(event: str, data: dict) -> dict:
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return {'type': 'http.response.body', 'body': f'event: {event}\ndata: {payload}\n\n'.encode('utf-8'),
+            'more_body': True}
+
+
+def _reply(chat: ChatBot, reply: str) -> dict:
+    has_commands = any(func in reply for func in get_func_list())
+    return {"reply": reply, "plan": chat.last_plan if has_commands else None,
+            "results": [result.model_dump() for result in chat.last_results]}
+
+
+def _send_message(chat: ChatBot, send_message: Callable[[], str]) -> dict:
+    # the reply, or the outcome of every command if some of them failed
+    try:
+        return _reply(chat, send_message())
+    except Exception:
+        if all(result.succeeded for result in chat.last_results):
+            raise
+        return {"error": str(ODSLExecutionError(chat.last_results)), "plan": chat.last_plan,
+                "results": [result.model_dump() for result in chat.last_results]}
+
+
+class ChatAPI:
+    """
+    The ASGI application, e.g. uvicorn api:app.
+
+    Attributes:
+        session_pool (SessionPool): The chat sessions.
+        worker_pool (WorkerPool): The threads running chatbot calls.
+    """
+
+    ROUTES = [
+        ('POST', re.compile(r'^/sessions/?$'), '__create_session__'),
+        ('DELETE', re.compile(r'^/sessions/(?P<session_id>[\w-]{1,64})/?$'), '__delete_session__'),
+        ('POST', re.compile(r'^/sessions/(?P<session_id>[\w-]{1,64})/messages/?$'), '__post_message__'),
+        ('GET', re.compile(r'^/sessions/(?P<session_id>[\w-]{1,64})/schedules/?$'), '__get_schedules__'),
+        ('POST', re.compile(r'^/sessions/(?P<session_id>[\w-]{1,64})/odsl/?$'), '__post_odsl__'),
+        ('GET', re.compile(r'^/health/?$'), '__get_health__'),
+    ]
+
+    def __init__(self, session_pool: Optional[SessionPool] = None, worker_pool: Optional[WorkerPool] = None):
+        """
+        Initializes the ChatAPI object.
+
+        Args:
+            session_pool (SessionPool): The chat sessions, a new pool by default.
+            worker_pool (WorkerPool): The threads running chatbot calls, sized by [api] by default.
+        """
+        settings = get_config().api
+        self.session_pool = session_pool or SessionPool()
+        self.worker_pool = worker_pool or WorkerPool(settings.workers, settings.max_queue)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.__lifespan__(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        try:
+            for method, pattern, handler in self.ROUTES:
+                match = pattern.match(scope['path'])
+                if match and scope['method'] == method:
+                    await getattr(self, handler)(receive, send, **match.groupdict())
+                    return
+            raise _HttpError(404, 'Not found')
+        except _HttpError as e:
+            await _send_json(send, e.status, {"error": str(e)}, e.headers)
+        except QueueFullError as e:
+            await _send_json(send, 503, {"error": str(e)}, ((b'retry-after', str(RETRY_AFTER).encode()),))
+        except SessionNotFoundError as e:
+            await _send_json(send, 404, {"error": str(e)})
+        except SessionBusyError as e:
+            await _send_json(send, 429, {"error": str(e)}, ((b'retry-after', str(RETRY_AFTER).encode()),))
+        except Exception as e:
+            logging.error(f'<ChatAPI>:{e}')
+            await _send_json(send, 500, {"error": str(e)})
+
+    async def __lifespan__(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    # fail on invalid settings before serving requests
+                    get_config()
+                    warm_metamodel()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.worker_pool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call_session__(self, session_id: str, fn: Callable[[ChatBot], dict]) -> dict:
+        # runs fn with the session's chatbot on a worker, holding one of the session's in-flight slots
+        def call():
+            with self.session_pool.acquire(session_id, create=False) as chat:
+                return fn(chat)
+        return await self.worker_pool.run(call)
+
+    async def __create_session__(self, receive, send):
+        session_id = uuid().hex
+        self.session_pool.get(session_id)
+        await _send_json(send, 201, {"session_id": session_id})
+
+    async def __delete_session__(self, receive, send, session_id: str):
+        if not self.session_pool.remove(session_id):
+            raise SessionNotFoundError(f'Session {session_id} not found')
+        await _send_json(send, 200, {"session_id": session_id})
+
+    async def __get_health__(self, receive, send):
+        await _send_json(send, 200, {"workers": self.worker_pool.stats(), "sessions": self.session_pool.stats()})
+
+    async def __get_schedules__(self, receive, send, session_id: str):
+        def schedules(chat: ChatBot) -> dict:
+            # numbers in later messages refer to this listing
+            return {"reply": chat.get_schedule_list(), "schedules": chat.schedule_list}
+
+        with self.worker_pool.slot():
+            await _send_json(send, 200, await self.__call_session__(session_id, schedules))
+
+    async def __post_odsl__(self, receive, send, session_id: str):
+        body = await _read_json(receive, get_config().api.max_body)
+        script = body.get('script')
+        if not isinstance(script, str) or not script.strip():
+            raise _HttpError(400, '"script" is required')
+
+        def odsl(chat: ChatBot) -> dict:
+            chat.dry_run = bool(body.get('dry_run', False))
+            try:
+                # clients may send schedule ids; only plain schedule numbers are resolved
+                commands = chat.execute_odsl(script, strict_numbers=True)
+            except TextXSyntaxError as e:
+                raise _HttpError(400, f'Invalid ODSL script: {e}')
+            except ValueError as e:
+                raise _HttpError(400, str(e))
+            except ODSLExecutionError as e:
+                return {"error": str(e), "plan": chat.last_plan, "results": [r.model_dump() for r in e.results]}
+            return {"commands": commands, "plan": chat.last_plan,
+                    "results": [r.model_dump() for r in chat.last_results]}
+
+        with self.worker_pool.slot():
+            result = await self.__call_session__(session_id, odsl)
+        await _send_json(send, 502 if "error" in result else 200, result)
+
+    async def __post_message__(self, receive, send, session_id: str):
+        body = await _read_json(receive, get_config().api.max_body)
+        message = body.get('message')
+        if not isinstance(message, str) or not message.strip():
+            raise _HttpError(400, '"message" is required')
+        dry_run = bool(body.get('dry_run', False))
+
+        if not body.get('stream'):
+            def reply(chat: ChatBot) -> dict:
+                chat.dry_run = dry_run
+                return _send_message(chat, lambda: chat.send_message(message))
+
+            with self.worker_pool.slot():
+                result = await self.__call_session__(session_id, reply)
+            await _send_json(send, 502 if "error" in result else 200, result)
+            return
+
+        with self.worker_pool.slot():
+            await self.__stream_message__(receive, send, session_id, message, dry_run)
+
+    async def __stream_message__(self, receive, send, session_id: str, message: str, dry_run: bool):
+        loop = asyncio.get_running_loop()
+        pieces = asyncio.Queue()
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        def stream_message(chat: ChatBot) -> str:
+            stream = chat.send_message_stream(message)
+            for text in stream:
+                if disconnected.is_set():
+                    stream.close()
+                    break
+                loop.call_soon_threadsafe(pieces.put_nowait, text)
+            return chat.last_response
+
+        def produce(chat: ChatBot) -> dict:
+            chat.dry_run = dry_run
+            if get_config().intent.pipelined:
+                return _send_message(chat, lambda: chat.send_message(message))
+            return _send_message(chat, lambda: stream_message(chat))
+
+        # busy sessions and a full queue are reported before the event stream starts
+        produced = asyncio.ensure_future(self.__call_session__(session_id, produce))
+        first = asyncio.ensure_future(pieces.get())
+        await asyncio.wait({produced, first}, return_when=asyncio.FIRST_COMPLETED)
+        if produced.done() and produced.exception() is not None and not first.done():
+            first.cancel()
+            raise produced.exception()
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]})
+        watcher = asyncio.ensure_future(watch_disconnect())
+        sent = ''
+        try:
+            while True:
+                if first is None:
+                    first = asyncio.ensure_future(pieces.get())
+                    await asyncio.wait({produced, first}, return_when=asyncio.FIRST_COMPLETED)
+                if not first.done():
+                    # the reply is complete; pieces queued before it are already in the queue
+                    first.cancel()
+                    texts = []
+                    while not pieces.empty():
+                        texts.append(pieces.get_nowait())
+                else:
+                    texts = [first.result()]
+                first = None
+                for text in texts:
+                    if text.startswith(sent):
+                        await send(_sse('delta', {"text": text[len(sent):]}))
+                    else:
+                        await send(_sse('reset', {"text": text}))
+                    sent = text
+                if produced.done() and pieces.empty():
+                    break
+            error = produced.exception()
+            if error is None:
+                result = produced.result()
+                await send(_sse('error' if "error" in result else 'done', result))
+            else:
+                await send(_sse('error', {"error": str(error)}))
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        except OSError:
+            # the client went away; stop generating
+            disconnected.set()
+        finally:
+            watcher.cancel()
@@ -2,32 +2,61 @@
 """
 This module contains the implementation of a ChatbotInterface and a ChatBot class that implements the interface.
 The ChatBot class uses IntentStrategy classes to execute different actions based on the user's intent.
-The ChatBot class also uses the O365Client class to interact with Microsoft Office 365 API to manage schedules.
-The ChatBot class uses the generate_odsl_execute function from the odsl_interpreter module to execute ODSL commands.
+The ChatBot class also uses the O365Client class, shared through client_provider, to interact with Microsoft Office 365 API to manage schedules.
+The ChatBot class uses the parse_odsl and execute_odsl_model functions from the odsl_interpreter module to parse ODSL once, bind schedule ids on the parsed commands and execute them.
 The ChatBot class uses the chat_completion function from the method_util module to generate responses based on the conversation history and user input.
-The DialogAction class is used to represent a dialog action with an id, intent, speaker, message, and timestamp.
+The TurnTrace class records the timings of a pipelined turn, where intent detection, the ODSL reply and a calendar
+prefetch run concurrently.
+The ConversationStore class, from the conversation_store module, keeps the conversation history of a ChatBot: its messages,
+each with an id, intent, speaker, message and timestamp, and their chat messages for the LLM.
 The Speaker enum is used to represent the speaker of a dialog action (USER or ASSISTANT).
 The GeneratePrompt enum is used to represent the type of prompt to generate a response.
 The UserIntent enum is used to represent the user's intent (MODIFY_SCHEDULE, REMOVE_SCHEDULE, LIST_SCHEDULE, ADD_SCHEDULE, or DEFAULT).
 """
 import logging
-from uuid import uuid4 as uuid
+import re
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from pydantic import BaseModel
-from module.odsl_interpreter import generate_odsl_execute
+from module.app_config import get_config
+from module.odsl_interpreter import CommandResult, ODSLExecutionError, execute_odsl_model, parse_odsl, warm_metamodel
+from module.odsl_parser import format_model
+from module.odsl_plan import ADD, compile_plan, format_plan
 from module.office_client_v2 import O365Client
+from module.client_provider import get_office_client
+from module.completion_cache import CachedCompletion
+from module.conversation_store import ConversationStore
 from module.enum_type import Speaker, GeneratePrompt, UserIntent
-from module.method_util import get_func_list, replace_first_param, try_get_first_parameter_in_function_call, try_parse_int, chat_completion
+from module.history_window import HistoryWindow, is_schedule_listing
+from module.intent_classifier import IntentClassifier, get_intent_classifier
+from module.method_util import get_func_list, parse_intent_odsl, try_parse_int, chat_completion, \
+    chat_completion_stream, stream_json_string
 
 
-class DialogAction(BaseModel):
-    id: str
-    intent: Optional[int] = 0
-    speaker: Speaker
-    message: str
-    timestamp: str
+# a schedule_id argument that is only a schedule number, e.g. "4" or "No.4"
+SCHEDULE_NUMBER = re.compile(r'(?:No\.?\s*)?\d+', re.IGNORECASE)
+
+
+class TurnTrace(BaseModel):
+    """
+    Timings of a pipelined turn, in seconds since the turn started.
+    """
+    stages: Dict[str, float] = {}
+    kept: List[str] = []
+    # stopped before they were done
+    cancelled: List[str] = []
+    # not needed, but too far along to be cancelled
+    discarded: List[str] = []
+    # until the intent and every kept stage were done
+    elapsed: float = 0.0
+
+    @property
+    def saved(self) -> float:
+        # what the kept stages would have taken one after another, minus what they took together
+        return max(sum(self.stages.get(stage, 0.0) for stage in self.kept) - self.elapsed, 0.0)
 
 
 class IntentStrategy(ABC):
@@ -35,31 +64,31 @@ class IntentStrategy(ABC):
         self.chatbot = chatbot
 
     @abstractmethod
-    def execute(self, question: str, intent: int):
+    def execute(self, question: str, intent: int, response: Optional[str] = None):
         pass
 
 
 class ModifyScheduleStrategy(IntentStrategy):
-    def execute(self, question: str, intent: int):
-        return self.chatbot.get_respond(question, intent)
+    def execute(self, question: str, intent: int, response: Optional[str] = None):
+        return self.chatbot.get_respond(question, intent, response)
 
 class RemoveScheduleStrategy(IntentStrategy):
-    def execute(self, question: str, intent: int):
-        return self.chatbot.get_respond(question, intent)
+    def execute(self, question: str, intent: int, response: Optional[str] = None):
+        return self.chatbot.get_respond(question, intent, response)
     
 class ListScheduleStrategy(IntentStrategy):
-    def execute(self, question: str, intent: int):
+    def execute(self, question: str, intent: int, response: Optional[str] = None):
         return self.chatbot.get_schedule_list()
 
 class DefaultStrategy(IntentStrategy):
-    def execute(self, question: str, intent: int):
-        return self.chatbot.get_respond(question, intent)
+    def execute(self, question: str, intent: int, response: Optional[str] = None):
+        return self.chatbot.get_respond(question, intent, response)
 
 
 class ChatbotInterface(ABC):
     @abstractmethod
     def __init__(self):
-        self.conversation_history: List[DialogAction] = []
+        self.conversation_history: ConversationStore = ConversationStore()
 
     @abstractmethod
     def send_message(self, question: str):
@@ -79,64 +108,260 @@ class ChatbotInterface(ABC):
 
 
 class ChatBot(ChatbotInterface):
+    # Number of upcoming events shown by a schedule list
+    SCHEDULE_LIST_SIZE = 20
+    # Seconds a listing keeps resolving schedule numbers before it is fetched again
+    SCHEDULE_INDEX_TTL = 300
 
-    def __init__(self):
+    def __init__(self, office_client: Optional[O365Client] = None,
+                 intent_classifier: Optional[IntentClassifier] = None):
         super().__init__()
-        self.conversation_history = []
-        self.office_client = O365Client()
+        self.conversation_history = ConversationStore(self.__conversation_log_path__())
+        # shared with the ODSL interpreter unless a client is injected
+        self.office_client = office_client or get_office_client()
+        # decides obvious intents locally, before the LLM is asked
+        self.intent_classifier = intent_classifier or get_intent_classifier()
         self.strategies = {
             UserIntent.MODIFY_SCHEDULE.value: ModifyScheduleStrategy(self),
             UserIntent.REMOVE_SCHEDULE.value: RemoveScheduleStrategy(self),
             UserIntent.LIST_SCHEDULE.value: ListScheduleStrategy(self)
         }
         self.schedule_list = []
+        # schedule number -> schedule id of the listing the user saw last
+        self.schedule_index: Dict[str, str] = {}
+        self.schedule_index_at: Optional[float] = None
+        # When dry_run is set, ODSL commands are planned but not executed.
+        self.dry_run = False
+        self.last_plan = ''
+        self.last_results: List[CommandResult] = []
+        # the reply of the last message, once send_message_stream is exhausted
+        self.last_response = ''
+        self.last_trace: Optional[TurnTrace] = None
+        warm_metamodel()
 
     def send_message(self, question: str) -> str:
+        self.last_results = []
         try:
+            if get_config().intent.pipelined:
+                respond_message = self.__send_pipelined__(question)
+                self.last_response = respond_message
+                return respond_message
             # Here you can implement your message sending logic
-            intent = self.get_intent(question)
-            action = DialogAction(id=str(uuid()), intent=intent, speaker=Speaker.USER,
-                                  message=question, timestamp=str(datetime.now()))
-            self.conversation_history.append(action)
-            logging.info('<send_message>')
-            logging.info(action)
-            # If intent is not a key in the dictionary, it returns DefaultStrategy()
-            strategy = self.strategies.get(intent, DefaultStrategy(self))
-            respond_message = strategy.execute(question, intent)
+            intent, response = self.__decide_intent__(question)
+            strategy = self.__record_question__(question, intent)
+            respond_message = strategy.execute(question, intent, response)
+            self.last_response = respond_message
             return respond_message
         except Exception as e:
             logging.error(e)
             raise Exception('Failed to send message')
 
+    def send_message_stream(self, question: str) -> Iterator[str]:
+        """
+        Like send_message, but yields the LLM reply so far each time a piece of it arrives.
+        ODSL commands are bound and executed once the reply is complete. The last value yielded is the final reply,
+        e.g. the commands with schedule ids, which is also in last_response when the generator is exhausted.
+        """
+        self.last_results = []
+        try:
+            intent, response = self.intent_classifier.predict(question), None
+            if intent is None and get_config().intent.combined:
+                # stream the "odsl" of the combined reply while it is generated
+                raw, streamed = [], ''
+                try:
+                    msg_history = self.get_conversation_history_with_speaker()
+                    completion = chat_completion_stream(msg_history, question, GeneratePrompt.INTENT_ODSL.value)
+                    for piece in stream_json_string(completion, 'odsl', raw):
+                        streamed += piece
+                        yield streamed
+                except Exception as e:
+                    logging.error(e)
+                combined = parse_intent_odsl(''.join(raw))
+                logging.info('<send_message_stream><combined>')
+                logging.info(combined)
+                if combined is not None:
+                    intent, response = combined
+                    self.__learn_intent__(question, intent, any(isinstance(piece, CachedCompletion) for piece in raw))
+
+            if intent is None:
+                intent = self.get_llm_intent(question)
+            strategy = self.__record_question__(question, intent)
+            if response is None and not isinstance(strategy, ListScheduleStrategy):
+                streamed = ''
+                msg_history = self.get_conversation_history_with_speaker()
+                for piece in chat_completion_stream(msg_history, question, GeneratePrompt.ODSL.value):
+                    streamed += piece
+                    yield streamed
+                response = streamed
+            respond_message = strategy.execute(question, intent, response)
+            self.last_response = respond_message
+            yield respond_message
+        except Exception as e:
+            logging.error(e)
+            raise Exception('Failed to send message')
+
+    def __send_pipelined__(self, question: str) -> str:
+        """
+        Detects the intent while the ODSL reply and the schedule list are fetched speculatively,
+        then uses or cancels each speculative branch. The timings are kept in last_trace.
+        """
+        trace = TurnTrace()
+        start = time.perf_counter()
+        speculative: Dict[str, Future] = {}
+
+        def track(stage: str, future: Future):
+            future.add_done_callback(lambda _: trace.stages.__setitem__(stage, time.perf_counter() - start))
+            speculative[stage] = future
+
+        intent, response = self.intent_classifier.predict(question), None
+        needs_listing = intent in (None, UserIntent.LIST_SCHEDULE.value) or (
+            intent in (UserIntent.MODIFY_SCHEDULE.value, UserIntent.REMOVE_SCHEDULE.value)
+            and not self.schedule_index_is_fresh())
+        if needs_listing:
+            track('calendar', self.submit_schedule_list())
+
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-speculation')
+        try:
+            if intent is None and get_config().intent.combined:
+                combined = self.get_intent_and_respond(question)
+                trace.stages['intent'] = time.perf_counter() - start
+                if combined is not None:
+                    intent, response = combined
+            if intent is None:
+                # the ODSL reply is only wasted if the intent turns out to be a schedule list
+                msg_history = self.get_conversation_history_with_speaker()
+                track('odsl', pool.submit(chat_completion, msg_history, question, GeneratePrompt.ODSL.value))
+                intent = self.get_llm_intent(question)
+                trace.stages['intent'] = time.perf_counter() - start
+            trace.kept.append('intent')
+
+            strategy = self.__record_question__(question, intent)
+            listing = self.__speculative_result__(trace, speculative, 'calendar',
+                                                  keep=isinstance(strategy, ListScheduleStrategy) or (
+                                                      intent in (UserIntent.MODIFY_SCHEDULE.value,
+                                                                 UserIntent.REMOVE_SCHEDULE.value)
+                                                      and not self.schedule_index_is_fresh()))
+            odsl = self.__speculative_result__(trace, speculative, 'odsl',
+                                               keep=not isinstance(strategy, ListScheduleStrategy))
+            trace.elapsed = time.perf_counter() - start
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        self.last_trace = trace
+        logging.info('<send_message><trace>')
+        logging.info(f'{trace}, saved={trace.saved:.3f}')
+        if isinstance(strategy, ListScheduleStrategy):
+            return self.get_schedule_list(listing)
+        if listing is not None:
+            # numbers in the reply resolve without another fetch
+            self.index_schedule_list(listing)
+        return strategy.execute(question, intent, response if odsl is None else odsl)
+
+    def __speculative_result__(self, trace: TurnTrace, speculative: Dict[str, Future], stage: str, keep: bool):
+        # the result of a kept speculative stage, or None once it is cancelled or failed
+        future = speculative.get(stage)
+        if future is None:
+            return None
+        if not keep:
+            if future.cancel():
+                trace.cancelled.append(stage)
+            else:
+                # already running: it still completes, only its result is not used
+                trace.discarded.append(stage)
+            return None
+        try:
+            result = future.result()
+        except Exception as e:
+            # the sequential path fetches it again
+            logging.error(f'<send_message>:speculative {stage} failed: {e}')
+            return None
+        trace.kept.append(stage)
+        return result
+
+    def __decide_intent__(self, question: str) -> Tuple[int, Optional[str]]:
+        # the intent, and the reply if it came with the intent
+        intent, response = self.intent_classifier.predict(question), None
+        if intent is None and get_config().intent.combined:
+            # one LLM call for the intent and the commands, the two calls below if it is not usable
+            combined = self.get_intent_and_respond(question)
+            if combined is not None:
+                intent, response = combined
+        if intent is None:
+            intent = self.get_llm_intent(question)
+        return intent, response
+
+    def __record_question__(self, question: str, intent: int) -> IntentStrategy:
+        action = self.conversation_history.append(Speaker.USER, question, intent)
+        logging.info('<send_message>')
+        logging.info(action)
+        # If intent is not a key in the dictionary, it returns DefaultStrategy()
+        return self.strategies.get(intent, DefaultStrategy(self))
+
     def get_intent(self, question: str) -> int:
+        intent_num = self.intent_classifier.predict(question)
+        if intent_num is None:
+            intent_num = self.get_llm_intent(question)
+        return intent_num
+
+    def get_llm_intent(self, question: str) -> int:
         try:
             # msg_history = self.get_conversation_history_with_speaker()
             intent_result = chat_completion([], question, GeneratePrompt.INTENT.value)
 
             if try_parse_int(intent_result):
                 intent_num = int(intent_result)
+                if intent_num in UserIntent._value2member_map_:
+                    self.__learn_intent__(question, intent_num, isinstance(intent_result, CachedCompletion))
             else:
                 intent_num = int(UserIntent.DEFAULT.value)
             logging.info('<get_intent>')
             logging.info(intent_num)
+            logging.info(self.intent_classifier.stats())
             return intent_num
         except Exception as e:
             logging.error(e)
             raise Exception('Failed to get intent')
 
-    def get_schedule_list(self) -> str:
+    def get_intent_and_respond(self, question: str) -> Optional[Tuple[int, str]]:
+        """
+        Asks the LLM for the intent and the ODSL reply in a single call.
+
+        Returns None when the completion fails, is not the expected JSON or carries commands the grammar rejects,
+        so the caller falls back to separate intent and ODSL calls.
+        """
+        try:
+            msg_history = self.get_conversation_history_with_speaker()
+            completion = chat_completion(msg_history, question, GeneratePrompt.INTENT_ODSL.value)
+            result = parse_intent_odsl(completion)
+        except Exception as e:
+            logging.error(e)
+            result = None
+        logging.info('<get_intent_and_respond>')
+        logging.info(result)
+        if result is not None:
+            self.__learn_intent__(question, result[0], isinstance(completion, CachedCompletion))
+        return result
+
+    def __learn_intent__(self, question: str, intent: int, cached: bool):
+        # a cached answer was learned when the LLM first gave it, and took no LLM call
+        if cached:
+            self.intent_classifier.record_cached()
+        else:
+            self.intent_classifier.learn(question, intent)
+
+    def get_schedule_list(self, schedule_list: Optional[List[dict]] = None) -> str:
         try:
-            schedule_ids = self.office_client.outlook_event_list()
+            schedule_ids = schedule_list if schedule_list is not None else self.fetch_schedule_list()
             self.schedule_list = schedule_ids
+            self.index_schedule_list(schedule_ids)
             schedule_ids_select = "".join(
                 [f"No.{s['no']} {s['subject']} {s['start']}-{s['end']}\n" for s in schedule_ids])
             
             if schedule_ids_select == "":
                 schedule_ids_select = "No schedule found"
 
-            nx_action = DialogAction(id=str(uuid()), intent=UserIntent.LIST_SCHEDULE.value, speaker=Speaker.ASSISTANT,
-                                     message=f"{schedule_ids_select}", timestamp=str(datetime.now()))
-            self.conversation_history.append(nx_action)
+            nx_action = self.conversation_history.append(Speaker.ASSISTANT, schedule_ids_select,
+                                                         UserIntent.LIST_SCHEDULE)
 
             logging.info('<get_schedule_list>')
             logging.info(nx_action)
@@ -145,61 +370,131 @@ class ChatBot(ChatbotInterface):
             logging.error(e)
             raise Exception('Failed to get schedule list')
 
-    def get_respond(self, question: str, intent: int) -> str:
+    def fetch_schedule_list(self) -> List[dict]:
+        """
+        Fetches the next SCHEDULE_LIST_SIZE events; schedule numbers refer to this listing.
+        """
+        return self.office_client.outlook_event_list(**self.__schedule_list_window__())
+
+    def submit_schedule_list(self) -> Future:
+        """
+        Like fetch_schedule_list, but returns a Future of the listing without waiting for it.
+        """
+        return self.office_client.submit_event_list(**self.__schedule_list_window__())
+
+    def __schedule_list_window__(self) -> dict:
+        return {"start": datetime.utcnow(), "top": self.SCHEDULE_LIST_SIZE}
+
+    def get_respond(self, question: str, intent: int, response: Optional[str] = None) -> str:
         try:
             msg_history = self.get_conversation_history_with_speaker()
-            response = chat_completion(msg_history,
-                                       question, GeneratePrompt.ODSL.value)
-            response_action = DialogAction(id=str(uuid()), intent=intent, speaker=Speaker.ASSISTANT,
-                                           message=response, timestamp=str(datetime.now()))
+            if response is None:
+                response = chat_completion(msg_history,
+                                           question, GeneratePrompt.ODSL.value)
+            response_action = self.conversation_history.append(Speaker.ASSISTANT, response, intent)
             logging.info('<get_respond>')
             logging.info(msg_history)
             logging.info(response_action)
-            self.conversation_history.append(response_action)
 
             func_list = get_func_list()
 
             if any(func in response_action.message for func in func_list):
-                func_call = response_action.message
-                logging.info('<get_respond><func_call>')
-                logging.info(func_call)
-                schedule_id = self.get_schedule_id(func_call)
-
-                if schedule_id:
-                    schedule_id = self.get_schedule_id(func_call)
-                    func_call = replace_first_param(func_call, schedule_id)
-                    logging.info('<get_respond><func_call>2')
-                    logging.info(func_call)
-                    generate_odsl_execute(func_call)
-                else:
-                    generate_odsl_execute(func_call)
-
-                response_action.message = func_call
+                func_call = self.execute_odsl(response_action.message)
+                self.conversation_history.replace_message(response_action, func_call)
 
             return response_action.message
         except Exception as e:
             raise Exception('Failed to get respond: {}'.format(e))
 
-    def get_schedule_id(self, question: str) -> str:
+    def execute_odsl(self, script: str, strict_numbers: bool = False) -> str:
+        """
+        Parses an ODSL script once, binds schedule numbers on the AST, plans and executes the plan.
+        The plan is kept in last_plan and the outcome of every command in last_results.
+        With strict_numbers, only schedule_id values that are a number or "No.N" are bound, see bind_schedule_ids.
+
+        Returns the planned commands with schedule ids, or the plan if everything was optimized away.
+        Raises ValueError for list_outlook_schedule(), which lists schedules instead of changing them.
+        """
+        model = parse_odsl(script)
+        # textX reduces list_outlook_schedule() to its text, see odsl_parser
+        if any(isinstance(command, str) for command in model.commands):
+            raise ValueError('list_outlook_schedule() cannot be executed, list the schedules instead')
+        self.bind_schedule_ids(model, strict_numbers)
+        plan = compile_plan(model)
+        self.last_plan = format_plan(plan)
+        # everything may have been optimized away, show the plan instead of an empty reply
+        func_call = format_model(plan) or self.last_plan
+        logging.info('<get_respond><func_call>')
+        logging.info(func_call)
+        logging.info(self.last_plan)
+        self.last_results = []
+        if not self.dry_run:
+            try:
+                self.last_results = execute_odsl_model(plan, client=self.office_client)
+            except ODSLExecutionError as e:
+                # the outcome of every command, for the caller to report the failed ones
+                self.last_results = e.results
+                raise
+            finally:
+                # our own writes renumber the upcoming schedules
+                self.invalidate_schedule_index()
+        return func_call
+
+    def bind_schedule_ids(self, model, strict_numbers: bool = False):
+        """
+        Replaces the schedule numbers shown to the user with schedule ids, in place.
+        The number is the first one in the argument, e.g. 4 in "No.4 H2 Goals", or with strict_numbers only an
+        argument that is a number or "No.N", so schedule ids sent by programmatic clients pass through unchanged.
+
+        Commands without a schedule_id argument are left untouched, and so is an argument
+        that does not resolve to a listed schedule, or that is the description of an event added earlier
+        in the script, so compile_plan can still cancel add-then-remove. The schedules are fetched at most once.
+        """
+        indexed_at = self.schedule_index_at
+        added = set()
+        for command in model.commands:
+            if command.__class__.__name__ == ADD:
+                added.add(command.description)
+                continue
+            target_no = getattr(command, 'schedule_id', None)
+            if target_no is None or target_no in added:
+                continue
+            if strict_numbers and not SCHEDULE_NUMBER.fullmatch(target_no.strip()):
+                continue
+            schedule_id = self.get_schedule_id(target_no, refetch=self.schedule_index_at == indexed_at)
+            if schedule_id:
+                command.schedule_id = schedule_id
+
+    def index_schedule_list(self, schedule_list: List[dict]):
+        """
+        Indexes a listing by schedule number, so numbers resolve to the ids that were listed.
+        """
+        self.schedule_index = {str(schedule['no']): schedule['id'] for schedule in schedule_list}
+        self.schedule_index_at = time.monotonic()
+
+    def invalidate_schedule_index(self):
+        self.schedule_index = {}
+        self.schedule_index_at = None
+
+    def schedule_index_is_fresh(self) -> bool:
+        return self.schedule_index_at is not None and \
+            time.monotonic() - self.schedule_index_at < self.SCHEDULE_INDEX_TTL
+
+    def get_schedule_id(self, target_no: str, refetch: bool = True) -> Optional[str]:
         try:
-            _target_no = try_get_first_parameter_in_function_call(question)
-
-            # find schedule id in schedule list by schedule no.
-            import re
-            match = re.search(r'\d+', _target_no)  # "No.4 H2 Goals" -> "4"
-            target_no = None
+            # find schedule id in schedule index by schedule no.
+            match = re.search(r'\d+', target_no)  # "No.4 H2 Goals" -> "4"
+            schedule_no = None
             if match:
-                target_no = match.group()
-            schedule_ids = self.office_client.outlook_event_list()
-            schedule_no = [schedule['id'] for schedule in schedule_ids if str(
-                schedule['no']) == target_no]
+                schedule_no = match.group()
 
-            schedule_id = None
-            logging.info(
-                f'<get_schedule_no>:{_target_no}:{target_no}:{schedule_no}')
-            if len(schedule_no) > 0:
-                schedule_id = schedule_no[0]
+            schedule_id = self.schedule_index.get(schedule_no) if self.schedule_index_is_fresh() else None
+            if schedule_id is None and refetch:
+                # a stale index or an unknown number: fetch the schedules again
+                self.index_schedule_list(self.fetch_schedule_list())
+                schedule_id = self.schedule_index.get(schedule_no)
 
+            logging.info(f'<get_schedule_no>:{target_no}:{schedule_no}')
             logging.info(f'<get_schedule_id>{schedule_id}')
 
             return schedule_id
@@ -207,14 +502,28 @@ class ChatBot(ChatbotInterface):
             logging.error(f'Failed to get schedule id: {e}')
             raise Exception('Failed to get schedule id')
 
-    def get_conversation_history(self) -> List[DialogAction]:
+    def get_conversation_history(self) -> ConversationStore:
         return self.conversation_history
 
     def clear_conversation_history(self):
         self.conversation_history.clear()
 
+    def trim_conversation_history(self, max_messages: int):
+        """
+        Drops the oldest messages beyond max_messages, but keeps the latest schedule listing.
+        """
+        self.conversation_history.trim(max_messages, keep=is_schedule_listing)
+
+    def __conversation_log_path__(self) -> Optional[str]:
+        config = get_config()
+        return config.resolve_path(config.history.log_path) if config.history.log_path else None
+
     def get_conversation_history_with_speaker(self) -> List[dict]:
-        conversation_history_for_oai = [
-            {"role": action.speaker.value, "content": action.message} for action in self.conversation_history]
+        # only the newest turns within the token budget, and the latest schedule listing
+        window = HistoryWindow(get_config().history.max_tokens)
+        selected = window.select(self.conversation_history)
+        if len(selected) == len(self.conversation_history):
+            return self.conversation_history.messages()
+        conversation_history_for_oai = [action.openai_message for action in selected]
 
         return conversation_history_for_oai
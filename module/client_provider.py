@@ -0,0 +1,45 @@
+"""
+This module contains the process-wide provider of the O365Client.
+The chat flow and the ODSL interpreter get their Graph client from get_office_client instead of constructing their own,
+so settings are loaded once and every command of a script reuses the same client.
+Tests and alternative front ends can inject a client with set_office_client.
+"""
+import threading
+from typing import Optional
+from module.office_client_v2 import O365Client
+
+_office_client: Optional[O365Client] = None
+_office_client_lock = threading.Lock()
+
+
+def get_office_client() -> O365Client:
+    """
+    Returns the shared O365Client, creating it on first use.
+
+    Returns:
+        O365Client: The shared client.
+    """
+    global _office_client
+    client = _office_client
+    if client is None:
+        with _office_client_lock:
+            if _office_client is None:
+                _office_client = O365Client()
+            client = _office_client
+    return client
+
+
+def set_office_client(client: Optional[O365Client]) -> Optional[O365Client]:
+    """
+    Replaces the shared O365Client, e.g. with a fake in tests.
+
+    Args:
+        client (O365Client): The client to share, or None to create a new one on next use.
+
+    Returns:
+        O365Client: The previously shared client.
+    """
+    global _office_client
+    with _office_client_lock:
+        previous, _office_client = _office_client, client
+    return previous
@@ -0,0 +1,264 @@
+"""
+This module contains the completion cache consulted by chat_completion before it calls Azure OpenAI.
+Entries are keyed on the prompt type, a hash of the system prompt and the normalized input, i.e. the question and any
+conversation history, so a changed prompt never serves stale answers and "Show me my schedule!" hits the entry of
+"show me my schedule". Entries expire after a TTL, the in-memory tier evicts the least recently used entries, and an
+optional SQLite tier keeps entries across restarts. Answers that depend on the current date, such as ODSL commands
+with dates or answers to "tomorrow", are only reused on the day they were generated.
+"""
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date
+from typing import List, Optional, Tuple
+from module.app_config import get_config
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 3600
+
+# absolute dates in answers, and relative dates in questions
+DATE_SENSITIVE = re.compile(
+    r"\d{4}-\d{2}-\d{2}|YYYY-MM-DD|\b(today|tonight|tomorrow|yesterday|now|next|last|this|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday|week|weekend|month)\b", re.IGNORECASE)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    day TEXT
+);
+'''
+
+
+def normalize(text: str) -> str:
+    """
+    Normalizes an input for the cache key: lower case, single spaces and no trailing punctuation.
+    """
+    return re.sub(r'\s+', ' ', text).strip().rstrip('.!?').strip().lower()
+
+
+def cache_key(prompt_type: str, system_prompt: str, conversation_history: List[dict], question: str) -> str:
+    """
+    Returns the cache key of a completion request.
+
+    Args:
+        prompt_type (str): The GeneratePrompt value.
+        system_prompt (str): The system prompt of the prompt type.
+        conversation_history (list): The {"role", "content"} messages sent before the question.
+        question (str): The user's question.
+
+    Returns:
+        str: The key.
+    """
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    user_input = [[message['role'], normalize(message['content'] or '')] for message in conversation_history]
+    user_input.append(['user', normalize(question)])
+    payload = json.dumps([prompt_type, prompt_hash, user_input], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CachedCompletion(str):
+    """
+    A completion served from the cache, so callers can tell it from an answer the LLM just generated.
+    """
+
+
+class CacheBackend(ABC):
+    """
+    A storage tier of the CompletionCache. Entries are (value, expires_at, day) tuples.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[str, float, Optional[str]]]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, entry: Tuple[str, float, Optional[str]]):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    An in-memory tier holding at most max_entries entries, evicting the least recently used.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, float, Optional[str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Tuple[str, float, Optional[str]]):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    A SQLite tier that keeps entries across restarts. Expired entries are purged when the file is opened.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute('DELETE FROM completions WHERE expires_at < ?', (time.time(),))
+
+    def get(self, key: str) -> Optional[Tuple[str, float, Optional[str]]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at, day FROM completions WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key: str, entry: Tuple[str, float, Optional[str]]):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO completions (key, value, expires_at, day) VALUES (?, ?, ?, ?)',
+                               (key, *entry))
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM completions WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM completions')
+
+
+class CompletionCache:
+    """
+    A completion cache over one or more backends, looked up in order; a hit in a later tier fills the earlier ones.
+
+    Attributes:
+        backends (list): The CacheBackend tiers, the fastest first.
+        ttl (float): Seconds an entry is served.
+    """
+
+    def __init__(self, backends: List[CacheBackend], ttl: float = DEFAULT_TTL):
+        """
+        Initializes the CompletionCache object.
+
+        Args:
+            backends (list): The CacheBackend tiers, the fastest first.
+            ttl (float): Seconds an entry is served.
+        """
+        self.backends = backends
+        self.ttl = ttl
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0}
+        self._stats_lock = threading.Lock()
+
+    def __count__(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def get(self, key: str) -> Optional[CachedCompletion]:
+        """
+        Returns the cached completion of a key, or None.
+        """
+        for idx, backend in enumerate(self.backends):
+            entry = backend.get(key)
+            if entry is None:
+                continue
+            value, expires_at, day = entry
+            if expires_at < time.time() or (day is not None and day != date.today().isoformat()):
+                self.__count__("expired")
+                backend.delete(key)
+                continue
+            for faster in self.backends[:idx]:
+                faster.put(key, entry)
+            self.__count__("hits")
+            return CachedCompletion(value)
+        self.__count__("misses")
+        return None
+
+    def put(self, key: str, value: str, user_input: str = ''):
+        """
+        Stores a completion. It is only served on the current day if it or the input mentions a date.
+
+        Args:
+            key (str): The cache key.
+            value (str): The completion.
+            user_input (str): The question the completion answers.
+        """
+        day = date.today().isoformat() if DATE_SENSITIVE.search(value) or DATE_SENSITIVE.search(user_input) else None
+        entry = (value, time.time() + self.ttl, day)
+        for backend in self.backends:
+            try:
+                backend.put(key, entry)
+            except sqlite3.Error as e:
+                logging.error(f'Failed to cache completion: {e}')
+        self.__count__("stores")
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: "hits", "misses", "stores", "expired" entries and the "hit_rate".
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        looked_up = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / looked_up, 3) if looked_up else 0.0
+        return stats
+
+
+# (settings the cache was built from, CompletionCache)
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """
+    Returns the shared CompletionCache, rebuilt only when its [completion_cache] settings change.
+    """
+    global _completion_cache
+    config = get_config()
+    settings = config.completion_cache
+    with _completion_cache_lock:
+        if _completion_cache is None or _completion_cache[0] != settings:
+            backends = [LRUCacheBackend(settings.max_entries)]
+            if settings.path:
+                backends.append(SQLiteCacheBackend(config.resolve_path(settings.path)))
+            _completion_cache = (settings, CompletionCache(backends, settings.ttl))
+        return _completion_cache[1]
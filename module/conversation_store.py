@@ -0,0 +1,177 @@
+"""
+This module contains the conversation history of a ChatBot.
+DialogAction is a __slots__ record with a sequence number for an id, the Speaker and UserIntent enum members instead
+of strings or ints, and a float timestamp. ConversationStore appends them and keeps their OpenAI chat messages in a
+list that is extended as the conversation grows, so a turn does not rebuild the messages of the whole history.
+With a log path, every appended or rewritten message is also written to an append-only JSON lines audit log.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from itertools import count
+from typing import Iterator, List, Optional, Union
+from uuid import uuid4 as uuid
+from module.enum_type import Speaker, UserIntent
+
+# audit log path -> lock; sessions of one process append to the same file
+_log_locks = {}
+_log_locks_lock = threading.Lock()
+
+
+def _log_lock(path: str) -> threading.Lock:
+    with _log_locks_lock:
+        return _log_locks.setdefault(path, threading.Lock())
+
+
+def as_intent(intent: Union[int, UserIntent, None]) -> UserIntent:
+    """
+    Returns the UserIntent member of an intent number; numbers without one are handled as DEFAULT.
+    """
+    if isinstance(intent, UserIntent):
+        return intent
+    return UserIntent._value2member_map_.get(intent, UserIntent.DEFAULT)
+
+
+class DialogAction:
+    """
+    A message of the conversation.
+
+    Attributes:
+        id (int): The sequence number of the message in its conversation.
+        intent (UserIntent): The intent of the turn.
+        speaker (Speaker): Who sent the message.
+        message (str): The message.
+        timestamp (float): When the message was recorded, as time.time().
+    """
+    __slots__ = ('id', 'intent', 'speaker', 'message', 'timestamp', '_openai_message')
+
+    def __init__(self, id: int, intent: UserIntent, speaker: Speaker, message: str, timestamp: float):
+        self.id = id
+        self.intent = intent
+        self.speaker = speaker
+        self.message = message
+        self.timestamp = timestamp
+        self._openai_message = None
+
+    @property
+    def openai_message(self) -> dict:
+        """
+        The {"role", "content"} chat message, built once; do not modify it.
+        """
+        if self._openai_message is None:
+            self._openai_message = {"role": self.speaker.value, "content": self.message}
+        return self._openai_message
+
+    @property
+    def datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp)
+
+    def __repr__(self):
+        return (f'DialogAction(id={self.id}, intent={self.intent.name}, speaker={self.speaker.name}, '
+                f'message={self.message!r}, timestamp={self.datetime})')
+
+
+class ConversationStore:
+    """
+    The messages of one conversation, oldest first, with their chat messages kept alongside.
+    Supports len, iteration and indexing like the list it replaces.
+
+    Attributes:
+        conversation_id (str): Identifies the conversation in the audit log.
+        log_path (str): The append-only audit log, none for no log.
+    """
+
+    def __init__(self, log_path: Optional[str] = None):
+        """
+        Initializes the ConversationStore object.
+
+        Args:
+            log_path (str): JSON lines file every message is appended to, none for no log.
+        """
+        self.conversation_id = uuid().hex
+        self.log_path = log_path
+        self._actions: List[DialogAction] = []
+        self._messages: List[dict] = []
+        self._ids = count()
+
+    def __len__(self) -> int:
+        return len(self._actions)
+
+    def __iter__(self) -> Iterator[DialogAction]:
+        return iter(self._actions)
+
+    def __getitem__(self, idx):
+        return self._actions[idx]
+
+    def append(self, speaker: Speaker, message: str, intent: Union[int, UserIntent, None] = None) -> DialogAction:
+        """
+        Records a message.
+
+        Args:
+            speaker (Speaker): Who sent the message.
+            message (str): The message.
+            intent (int): The intent of the turn.
+
+        Returns:
+            DialogAction: The recorded message.
+        """
+        action = DialogAction(next(self._ids), as_intent(intent), speaker, message, time.time())
+        self._actions.append(action)
+        self._messages.append(action.openai_message)
+        self.__log__('append', action)
+        return action
+
+    def replace_message(self, action: DialogAction, message: str):
+        """
+        Rewrites a recorded message, e.g. an ODSL reply once its schedule numbers are bound.
+        """
+        action.message = message
+        action._openai_message = None
+        for idx in range(len(self._actions) - 1, -1, -1):
+            if self._actions[idx] is action:
+                self._messages[idx] = action.openai_message
+                break
+        self.__log__('replace', action)
+
+    def messages(self) -> List[dict]:
+        """
+        Returns the chat messages of the whole conversation; the list is shared, do not modify it.
+        """
+        return self._messages
+
+    def trim(self, max_messages: int, keep=None):
+        """
+        Drops the oldest messages beyond max_messages.
+
+        Args:
+            max_messages (int): The number of messages to keep.
+            keep (callable): Predicate of a message to keep as well if it is the latest one it accepts.
+        """
+        overflow = len(self._actions) - max_messages
+        if overflow <= 0:
+            return
+        kept = self._actions[overflow:]
+        if keep is not None and not any(keep(action) for action in kept):
+            pinned = next((action for action in reversed(self._actions[:overflow]) if keep(action)), None)
+            if pinned is not None:
+                kept.insert(0, pinned)
+        self._actions = kept
+        self._messages = [action.openai_message for action in kept]
+
+    def clear(self):
+        self._actions = []
+        self._messages = []
+
+    def __log__(self, op: str, action: DialogAction):
+        if not self.log_path:
+            return
+        line = json.dumps({"op": op, "conversation": self.conversation_id, "id": action.id,
+                           "speaker": action.speaker.value, "intent": action.intent.value,
+                           "message": action.message, "timestamp": action.timestamp}, ensure_ascii=False)
+        try:
+            with _log_lock(self.log_path), open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logging.error(f'Failed to write conversation log: {e}')
@@ -11,6 +11,7 @@ class GeneratePrompt(Enum):
     INTENT = "intent"
     ODSL = "odsl"
     SCHEDULE_ID = "schedule_id"
+    INTENT_ODSL = "intent_odsl"
 
 
 class UserIntent(Enum):
@@ -18,4 +19,10 @@ class UserIntent(Enum):
     MODIFY_SCHEDULE = 2
     REMOVE_SCHEDULE = 3
     LIST_SCHEDULE = 4
-    DEFAULT = 5
\ No newline at end of file
+    DEFAULT = 5
+
+
+class ExecutionMode(Enum):
+    SERIAL = "serial"
+    BATCH = "batch"
+    PARALLEL = "parallel"
@@ -0,0 +1,219 @@
+"""
+This module contains the throttling-aware retry and the adaptive concurrency limiter used by AsyncO365Client.
+Graph answers bursts with 429 (and sometimes 503) and a Retry-After header. send_with_retry waits as told, or for a
+jittered exponential backoff without one, and sends the request again. AdaptiveLimiter caps the number of requests in
+flight: the cap is halved when Graph throttles and grows back by one per cap-many successful requests (AIMD),
+so a burst slows down instead of failing. retry_stats exports the counters of both.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+import httpx
+
+# statuses Graph uses for throttling and transient unavailability
+RETRY_STATUSES = (429, 503)
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30
+DEFAULT_MAX_CONCURRENCY = 10
+# throttled responses within this many seconds of a decrease belong to the same burst and do not shrink the cap again
+DECREASE_COOLDOWN = 1.0
+
+_stats = {"requests": 0, "retries": 0, "throttled": 0, "gave_up": 0}
+_stats_lock = threading.Lock()
+# event loop -> AdaptiveLimiter; asyncio primitives belong to the loop they are used on
+_limiters = weakref.WeakKeyDictionary()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class AdaptiveLimiter:
+    """
+    An AIMD concurrency limiter for the requests of one event loop.
+
+    Attributes:
+        limit (float): The current number of requests allowed in flight.
+        in_flight (int): The number of requests in flight.
+    """
+
+    def __init__(self, max_limit: int = DEFAULT_MAX_CONCURRENCY, min_limit: int = 1):
+        """
+        Initializes the AdaptiveLimiter object.
+
+        Args:
+            max_limit (int): The cap the limit grows back to, e.g. the connection pool size.
+            min_limit (int): The floor the limit never shrinks below.
+        """
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+    def on_success(self):
+        """
+        Additive increase: one more request in flight per `limit` successful requests.
+        """
+        if self.limit < self.max_limit:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def on_throttle(self):
+        """
+        Multiplicative decrease: halve the requests in flight, once per burst.
+        """
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(self.limit / 2, self.min_limit)
+        logging.info(f'<AdaptiveLimiter>:throttled, limit {self.limit:.1f}')
+
+
+def get_limiter(max_limit: int = DEFAULT_MAX_CONCURRENCY) -> AdaptiveLimiter:
+    """
+    Returns the limiter of the running event loop, creating it on first use.
+
+    Args:
+        max_limit (int): The cap of a new limiter.
+
+    Returns:
+        AdaptiveLimiter: The shared limiter.
+    """
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = AdaptiveLimiter(max_limit)
+    return limiter
+
+
+def retry_after(headers) -> Optional[float]:
+    """
+    Returns the seconds to wait from a Retry-After header, given in seconds or as an HTTP date.
+
+    Args:
+        headers (Mapping): The response headers.
+
+    Returns:
+        float: The seconds to wait, or None without a usable header.
+    """
+    value = (headers.get("Retry-After") or headers.get("retry-after")) if headers else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY) -> float:
+    """
+    Returns a full-jitter exponential backoff delay, so throttled clients do not retry in lockstep.
+
+    Args:
+        attempt (int): The number of the retry, starting at 0.
+        base_delay (float): The delay cap of the first retry.
+        max_delay (float): The largest delay cap.
+
+    Returns:
+        float: The seconds to wait.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def send_with_retry(send: Callable[[], Awaitable[httpx.Response]], limiter: Optional[AdaptiveLimiter] = None,
+                          max_retries: int = DEFAULT_MAX_RETRIES, base_delay: float = DEFAULT_BASE_DELAY,
+                          max_delay: float = DEFAULT_MAX_DELAY) -> httpx.Response:
+    """
+    Sends a request within the concurrency limit, retrying throttled responses and failed connection attempts.
+
+    Args:
+        send (callable): Coroutine function that sends the request once.
+        limiter (AdaptiveLimiter): The limiter, none for unlimited concurrency.
+        max_retries (int): The number of retries before the last response is returned as is.
+        base_delay (float): See backoff_delay.
+        max_delay (float): See backoff_delay.
+
+    Returns:
+        httpx.Response: The final response, which still has a throttling status when the retries ran out.
+    """
+    attempt = 0
+    while True:
+        _count("requests")
+        try:
+            if limiter is not None:
+                async with limiter:
+                    response = await send()
+            else:
+                response = await send()
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            # the request never reached Graph, so even a POST is safe to send again
+            if attempt >= max_retries:
+                _count("gave_up")
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                if limiter is not None:
+                    limiter.on_success()
+                return response
+            _count("throttled")
+            if limiter is not None:
+                limiter.on_throttle()
+            if attempt >= max_retries:
+                _count("gave_up")
+                return response
+            delay = retry_after(response.headers)
+            if delay is None:
+                delay = backoff_delay(attempt, base_delay, max_delay)
+            logging.info(f'<send_with_retry>:{response.status_code}, retrying in {delay:.2f}s')
+
+        _count("retries")
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def retry_stats() -> dict:
+    """
+    Returns the retry and throttling counters, and the state of the limiters.
+
+    Returns:
+        dict: "requests" attempts sent, "retries", "throttled" responses, requests that "gave_up",
+            and the summed "limit" and "in_flight" of the limiters.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    limiters = list(_limiters.values())
+    stats["limit"] = round(sum(limiter.limit for limiter in limiters), 2)
+    stats["in_flight"] = sum(limiter.in_flight for limiter in limiters)
+    return stats
@@ -0,0 +1,118 @@
+"""
+This module contains the token-budgeted window over the conversation history sent with each completion.
+HistoryWindow keeps the newest messages that fit in the [history] max_tokens budget and drops older turns, but always
+keeps the latest schedule listing, since the schedule numbers in a request refer to it. Token counts are cached per
+message text and use tiktoken when it is installed, or an estimate of about four characters per token otherwise.
+"""
+import logging
+import math
+from functools import lru_cache
+from typing import List, Optional
+from module.enum_type import Speaker, UserIntent
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency
+    tiktoken = None
+
+# tokens the chat format adds to every message
+MESSAGE_OVERHEAD = 4
+TIKTOKEN_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    except Exception as e:
+        # e.g. the encoding cannot be downloaded
+        logging.error(f'<history_window>:falling back to estimated token counts: {e}')
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    Returns the number of tokens of a text, cached per text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The number of tokens, estimated when tiktoken is not installed.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    """
+    Returns the number of prompt tokens of chat messages.
+
+    Args:
+        messages (list): The {"role", "content"} messages.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return sum(count_tokens(message["content"] or "") + MESSAGE_OVERHEAD for message in messages)
+
+
+def is_schedule_listing(action) -> bool:
+    return action.speaker is Speaker.ASSISTANT and action.intent is UserIntent.LIST_SCHEDULE
+
+
+class HistoryWindow:
+    """
+    Selects the part of a conversation history that fits in a token budget.
+
+    Attributes:
+        max_tokens (int): The token budget of the selected messages.
+    """
+
+    def __init__(self, max_tokens: int):
+        """
+        Initializes the HistoryWindow object.
+
+        Args:
+            max_tokens (int): The token budget of the selected messages.
+        """
+        self.max_tokens = max_tokens
+
+    def select(self, history: List) -> List:
+        """
+        Returns the newest messages of a history that fit in the budget, in order.
+        The latest schedule listing is kept even if it is older, or alone exceeds the budget.
+
+        Args:
+            history (list): The DialogAction messages, oldest first.
+
+        Returns:
+            list: The selected messages, oldest first.
+        """
+        listing: Optional[int] = next(
+            (idx for idx in range(len(history) - 1, -1, -1) if is_schedule_listing(history[idx])), None)
+        budget = self.max_tokens
+        if listing is not None:
+            budget -= count_tokens(history[listing].message) + MESSAGE_OVERHEAD
+
+        selected = []
+        for idx in range(len(history) - 1, -1, -1):
+            if idx == listing:
+                continue
+            tokens = count_tokens(history[idx].message) + MESSAGE_OVERHEAD
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append(idx)
+        if listing is not None:
+            selected.append(listing)
+
+        dropped = len(history) - len(selected)
+        if dropped:
+            logging.info(f'<HistoryWindow.select>:{dropped} of {len(history)} messages dropped')
+        return [history[idx] for idx in sorted(selected)]
@@ -0,0 +1,256 @@
+"""
+This module contains the local intent classifier that ChatBot.get_intent consults before the LLM.
+Obvious requests such as "show my schedules" or "delete No.3" are decided by keyword rules, other utterances by a small
+multinomial naive Bayes model trained on the utterances the LLM already classified, which are logged to a JSON lines
+file once per normalized utterance. Only a prediction at or above the confidence threshold is used; below it the caller
+falls back to the LLM and teaches the model its answer, unless the answer came from the completion cache.
+stats exports the share of intents decided locally.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from module.app_config import IntentSettings, get_config
+from module.completion_cache import normalize
+from module.enum_type import UserIntent
+
+# confidence of an intent decided by the rules
+RULE_CONFIDENCE = 0.99
+
+# one pattern per intent; a rule decides only when exactly one intent matches
+INTENT_RULES = {
+    UserIntent.ADD_SCHEDULE.value: re.compile(
+        r"\b(add|create|book|set up|register)\b|\bschedule (a|an|the)\b"),
+    UserIntent.MODIFY_SCHEDULE.value: re.compile(
+        r"\b(modify|update|change|move|reschedule|rename|postpone|edit)\b"),
+    UserIntent.REMOVE_SCHEDULE.value: re.compile(
+        r"\b(remove|delete|cancel|drop|erase)\b"),
+    UserIntent.LIST_SCHEDULE.value: re.compile(
+        r"\b(list|show|display|view)\b.*\b(schedules?|calendar|meetings?|events?|appointments?|plans?)\b"
+        r"|^(my )?(schedules?|calendar)\W*$"),
+}
+# negated requests are left to the LLM
+NEGATION = re.compile(r"\b(not|don't|dont|never|no longer)\b")
+TOKEN = re.compile(r"[a-z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits an utterance into lower case words and bigrams, with numbers folded into one token.
+    """
+    words = ['<num>' if word.isdigit() else word for word in TOKEN.findall(text.lower())]
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+
+class NaiveBayesIntentModel:
+    """
+    A multinomial naive Bayes model over the tokens of utterances, trained incrementally.
+
+    Attributes:
+        examples (int): The number of utterances learned.
+    """
+
+    def __init__(self, alpha: float = 1.0):
+        """
+        Initializes the NaiveBayesIntentModel object.
+
+        Args:
+            alpha (float): The additive smoothing of token counts.
+        """
+        self.alpha = alpha
+        self.examples = 0
+        self.class_counts: Counter = Counter()
+        self.token_counts: Dict[int, Counter] = defaultdict(Counter)
+        self.token_totals: Counter = Counter()
+        self.vocabulary = set()
+
+    def learn(self, text: str, intent: int):
+        tokens = tokenize(text)
+        self.examples += 1
+        self.class_counts[intent] += 1
+        self.token_counts[intent].update(tokens)
+        self.token_totals[intent] += len(tokens)
+        self.vocabulary.update(tokens)
+
+    def predict(self, text: str) -> Tuple[Optional[int], float]:
+        """
+        Returns the most probable intent of an utterance and its posterior probability.
+
+        Args:
+            text (str): The utterance.
+
+        Returns:
+            tuple: The intent, None before anything was learned, and its probability.
+        """
+        if not self.class_counts:
+            return None, 0.0
+        tokens = [token for token in tokenize(text) if token in self.vocabulary]
+        vocabulary_size = len(self.vocabulary)
+        scores = {}
+        for intent, count in self.class_counts.items():
+            denominator = self.token_totals[intent] + self.alpha * vocabulary_size
+            score = math.log(count / self.examples)
+            for token in tokens:
+                score += math.log((self.token_counts[intent][token] + self.alpha) / denominator)
+            scores[intent] = score
+        best = max(scores, key=scores.get)
+        # softmax of the log scores
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+
+class IntentClassifier:
+    """
+    Rules first, then the naive Bayes model once it learned enough examples.
+
+    Attributes:
+        model (NaiveBayesIntentModel): The model trained on the logged utterances.
+    """
+
+    def __init__(self, examples_path: Optional[str] = None):
+        """
+        Initializes the IntentClassifier object and trains the model on the logged utterances.
+
+        Args:
+            examples_path (str): JSON lines file of {"text", "intent"} utterances, none to keep them in memory only.
+        """
+        self.examples_path = examples_path
+        self.model = NaiveBayesIntentModel()
+        self._lock = threading.Lock()
+        self._stats = {"local": 0, "rules": 0, "model": 0, "llm": 0, "cached": 0}
+        # normalized utterance -> intent of every learned example, so each is learned once
+        self._learned: Dict[str, int] = {}
+        if examples_path and os.path.exists(examples_path):
+            self.__load_examples__()
+
+    def __load_examples__(self):
+        with open(self.examples_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    example = json.loads(line)
+                    text, intent = normalize(example['text']), int(example['intent'])
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # a line cut short by a crash
+                    continue
+                if text not in self._learned:
+                    self._learned[text] = intent
+                    self.model.learn(text, intent)
+        logging.info(f'<IntentClassifier>:{self.model.examples} examples loaded')
+
+    def classify(self, text: str, settings: Optional[IntentSettings] = None) -> Tuple[Optional[int], float, str]:
+        """
+        Classifies an utterance locally, regardless of the threshold.
+
+        Args:
+            text (str): The utterance.
+            settings (IntentSettings): The [intent] settings, the shared ones by default.
+
+        Returns:
+            tuple: The intent, None if undecided, the confidence and the "rules" or "model" that decided.
+        """
+        settings = settings or get_config().intent
+        normalized = text.lower().strip()
+        if not NEGATION.search(normalized):
+            matched = [intent for intent, rule in INTENT_RULES.items() if rule.search(normalized)]
+            if len(matched) == 1:
+                return matched[0], RULE_CONFIDENCE, 'rules'
+        with self._lock:
+            if self.model.examples < settings.min_examples or len(self.model.class_counts) < 2:
+                return None, 0.0, 'model'
+            intent, confidence = self.model.predict(normalized)
+        return intent, confidence, 'model'
+
+    def predict(self, text: str) -> Optional[int]:
+        """
+        Returns the intent of an utterance if it is decided locally with enough confidence.
+
+        Args:
+            text (str): The utterance.
+
+        Returns:
+            int: The intent, or None when the caller should ask the LLM.
+        """
+        settings = get_config().intent
+        if not settings.enabled:
+            return None
+        intent, confidence, source = self.classify(text, settings)
+        logging.info(f'<IntentClassifier.predict>:{intent}:{confidence:.2f}:{source}')
+        with self._lock:
+            if intent is None or confidence < settings.threshold:
+                self._stats["llm"] += 1
+                return None
+            self._stats["local"] += 1
+            self._stats[source] += 1
+        return intent
+
+    def learn(self, text: str, intent: int) -> bool:
+        """
+        Teaches the model the intent the LLM decided for an utterance, and logs it for the next start.
+        An utterance that was already learned, compared after normalization, is skipped.
+
+        Args:
+            text (str): The utterance.
+            intent (int): The intent.
+
+        Returns:
+            bool: Whether the utterance was new.
+        """
+        normalized = normalize(text)
+        with self._lock:
+            if normalized in self._learned:
+                return False
+            self._learned[normalized] = intent
+            self.model.learn(normalized, intent)
+            if self.examples_path:
+                try:
+                    with open(self.examples_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps({"text": text, "intent": intent}, ensure_ascii=False) + '\n')
+                except OSError as e:
+                    logging.error(f'Failed to log intent example: {e}')
+        return True
+
+    def record_cached(self):
+        """
+        Counts the last intent left to the LLM as served from the completion cache instead, as no LLM call was made.
+        """
+        with self._lock:
+            if self._stats["llm"] > 0:
+                self._stats["llm"] -= 1
+            self._stats["cached"] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the classification counters.
+
+        Returns:
+            dict: Intents decided "local"ly, by "rules" and by the "model", by the "llm", by a "cached" LLM answer,
+                the "hit_rate" of local decisions and the "examples" learned.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["examples"] = self.model.examples
+        decided = stats["local"] + stats["llm"] + stats["cached"]
+        stats["hit_rate"] = round(stats["local"] / decided, 3) if decided else 0.0
+        return stats
+
+
+# (examples path, IntentClassifier)
+_intent_classifier = None
+_intent_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier() -> IntentClassifier:
+    """
+    Returns the shared IntentClassifier, rebuilt only when the [intent] examples_path changes.
+    """
+    global _intent_classifier
+    config = get_config()
+    path = config.resolve_path(config.intent.examples_path) if config.intent.examples_path else None
+    with _intent_classifier_lock:
+        if _intent_classifier is None or _intent_classifier[0] != path:
+            _intent_classifier = (path, IntentClassifier(path))
+        return _intent_classifier[1]
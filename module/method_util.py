@@ -1,48 +1,165 @@
 
+import json
 import logging
-import os
 import re
-from module.odsl_interpreter import generate_odsl_execute
-from typing import List
-from dotenv import load_dotenv
-from module.enum_type import Speaker
+from module.odsl_interpreter import generate_odsl_execute, parse_odsl
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+from module.app_config import AzureOpenAISettings, get_config
+from module.completion_cache import CompletionCache, cache_key, get_completion_cache
+from module.enum_type import Speaker, UserIntent
+from module.history_window import count_message_tokens
 from module.prompt_mixer import return_prompt
 from openai import AzureOpenAI
 
-load_dotenv(verbose=False)
+# (settings the client was built from, AzureOpenAI client)
+_aoai_client = None
+_aoai_client_lock = threading.Lock()
 
-aoai_client = AzureOpenAI(
-    azure_endpoint=os.getenv("AZURE_OPEN_AI_ENDPOINT"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION_CHAT"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY")
-)
 
+def get_aoai_client(settings: AzureOpenAISettings) -> AzureOpenAI:
+    """
+    Returns the shared AzureOpenAI client, rebuilt only when its [azure_openai] settings change.
+    """
+    global _aoai_client
+    with _aoai_client_lock:
+        if _aoai_client is None or _aoai_client[0] != settings:
+            _aoai_client = (settings, AzureOpenAI(
+                azure_endpoint=settings.endpoint,
+                api_version=settings.api_version,
+                api_key=settings.api_key
+            ))
+        return _aoai_client[1]
 
-def chat_completion(conversation_history: List, question: str, prompt_type: str) -> str:
+
+def _create_completion(conversation_history: List, question: str, prompt_type: str, stream: bool = False):
     message_history = [{"role": Speaker.SYSTEM.value, "content": return_prompt(
         prompt_type)}] + conversation_history + [{"role": Speaker.USER.value, "content": question}]
 
+    logging.info(f'<chat_completion>:{prompt_type}:{count_message_tokens(message_history)} prompt tokens')
+    settings = get_config().azure_openai
+    return get_aoai_client(settings).chat.completions.create(
+        model=settings.deployment_name,
+        messages=message_history,
+        temperature=0.7,
+        max_tokens=800,
+        top_p=0.95,
+        frequency_penalty=0,
+        presence_penalty=0,
+        stop=None,
+        stream=stream
+    )
+
+
+def _cached_completion(conversation_history: List, question: str,
+                       prompt_type: str) -> Tuple[Optional[CompletionCache], Optional[str], Optional[str]]:
+    # the cache and key of a cacheable request and its cached completion, or Nones if it is not cacheable
+    settings = get_config().completion_cache
+    if not settings.enabled or prompt_type not in [prompt.value for prompt in settings.prompt_types]:
+        return None, None, None
+    cache = get_completion_cache()
+    key = cache_key(prompt_type, return_prompt(prompt_type), conversation_history, question)
+    cached = cache.get(key)
+    logging.info(f'<chat_completion>:cache {"hit" if cached is not None else "miss"}:{cache.stats()}')
+    return cache, key, cached
+
+
+def chat_completion(conversation_history: List, question: str, prompt_type: str) -> str:
+    """
+    Returns the completion of a question. A completion served from the cache is a CachedCompletion.
+    """
     try:
-        response = aoai_client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-            messages=message_history,
-            temperature=0.7,
-            max_tokens=800,
-            top_p=0.95,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=None
-        )
+        cache, key, cached = _cached_completion(conversation_history, question, prompt_type)
+        if cached is not None:
+            return cached
+        response = _create_completion(conversation_history, question, prompt_type)
 
         logging.info('<chat_completion>')
         msg = response.choices[0].message.content
         logging.info(msg)
+        if cache is not None and msg:
+            cache.put(key, msg, question)
         return msg
     except Exception as e:
         print(e)
         raise Exception('Failed to generate chat completion')
 
 
+def chat_completion_stream(conversation_history: List, question: str, prompt_type: str) -> Iterator[str]:
+    """
+    Streams a chat completion, yielding the pieces of the answer as they arrive.
+    Takes the same arguments as chat_completion. A completion served from the cache is yielded whole,
+    as a CachedCompletion.
+    """
+    try:
+        cache, key, cached = _cached_completion(conversation_history, question, prompt_type)
+        if cached is not None:
+            yield cached
+            return
+        start = time.perf_counter()
+        first_token = None
+        pieces = []
+        for chunk in _create_completion(conversation_history, question, prompt_type, stream=True):
+            # Azure sends the content filter results in chunks without choices
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - start
+                logging.info(f'<chat_completion_stream>:first token after {first_token:.2f}s')
+            pieces.append(chunk.choices[0].delta.content)
+            yield pieces[-1]
+
+        logging.info('<chat_completion_stream>')
+        logging.info(''.join(pieces))
+        if cache is not None and pieces:
+            cache.put(key, ''.join(pieces), question)
+    except Exception as e:
+        print(e)
+        raise Exception('Failed to generate chat completion')
+
+
+def stream_json_string(pieces: Iterator[str], field: str, raw: List[str]) -> Iterator[str]:
+    """
+    Yields the decoded value of a string field of a JSON object while the object is streamed.
+
+    Args:
+    pieces (Iterator[str]): The streamed JSON text, e.g. from chat_completion_stream.
+    field (str): The name of the string field.
+    raw (List[str]): Collects every piece, so the complete object can be parsed afterwards.
+    """
+    start = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+    buffer, pos, done = '', None, False
+    for piece in pieces:
+        raw.append(piece)
+        if done:
+            continue
+        buffer += piece
+        if pos is None:
+            match = start.search(buffer)
+            if match is None:
+                continue
+            pos = match.end()
+        decoded = []
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                done = True
+                break
+            if char == '\\':
+                # wait for the whole escape sequence
+                size = 6 if buffer[pos + 1:pos + 2] == 'u' else 2
+                if pos + size > len(buffer):
+                    break
+                decoded.append(json.loads(f'"{buffer[pos:pos + size]}"'))
+                pos += size
+            else:
+                decoded.append(char)
+                pos += 1
+        if decoded:
+            yield ''.join(decoded)
+
+
 def try_parse_int(str_input: str) -> bool:
     try:
         int(str_input)
@@ -66,28 +183,30 @@ def try_parse_odsl(str_input: str) -> bool:
         return False
 
 
-def try_get_first_parameter_in_function_call(func_call: str) -> str:
-    # Find the part of the string that is within parentheses
-    match = re.search('\((.*?)\)', func_call)
-    if match:
-        # Split the string within parentheses by comma
-        params = match.group(1).split(',')
-        # Return the first parameter after stripping leading/trailing white spaces
-        return params[0].strip()
-
-
-def replace_first_param(function_call, new_param) -> str:
-    # Find the part of the string that is within parentheses
-    match = re.search('\((.*?)\)', function_call)
-    if match:
-        # Split the string within parentheses by comma
-        params = match.group(1).split(',')
-        # Replace the first parameter with the new parameter
-        params[0] = f'\"{new_param}\"'
-        # Join the parameters back into a string with commas
-        new_params = ','.join(params)
-        # Replace the old parameters with the new parameters in the function call
-        return re.sub('\((.*?)\)', '(' + new_params + ')', function_call)
+def parse_intent_odsl(str_input: str) -> Optional[Tuple[int, str]]:
+    """
+    Reads the {"intent", "odsl"} JSON object of a combined intent and ODSL completion.
+    Commands in "odsl" must parse with the ODSL grammar; a plain answer without commands is kept as is.
+
+    Returns:
+    tuple: The intent and the ODSL, or None when the completion is not usable.
+    """
+    try:
+        # models sometimes wrap the object in a ```json fence
+        match = re.search(r'\{.*\}', str_input or '', re.DOTALL)
+        result = json.loads(match.group()) if match else None
+        intent, odsl = result['intent'], result.get('odsl') or ''
+        if isinstance(intent, bool) or int(intent) not in UserIntent._value2member_map_ or not isinstance(odsl, str):
+            raise ValueError(f'Unexpected intent or odsl: {result}')
+        odsl = odsl.strip().strip('`')
+        if not odsl and int(intent) != UserIntent.LIST_SCHEDULE.value:
+            raise ValueError('Missing odsl')
+        if any(func in odsl for func in get_func_list()):
+            parse_odsl(odsl)
+        return int(intent), odsl
+    except Exception as e:
+        logging.info(f'<parse_intent_odsl>:{e}')
+        return None
 
 
 def get_func_list() -> List:
@@ -6,13 +6,51 @@ The Command class represents a command in the ODSL language and is responsible f
 """
 from datetime import date, datetime
 import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from textx import metamodel_from_file
 
 from abc import ABC, abstractmethod
-from pydantic import Field
+from typing import List, Optional
+from pydantic import BaseModel, Field
 
 import os
+from module.app_config import get_config
 from module.office_client_v2 import O365Client
+from module.client_provider import get_office_client
+from module.enum_type import ExecutionMode
+from module import odsl_parser
+
+ODSL_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'odsl_model.txt')
+
+# grammar path -> (mtime of the grammar file, compiled meta-model)
+_metamodel_cache = {}
+_metamodel_lock = threading.Lock()
+
+COMMAND_ARGUMENTS = {'description', 'start_time', 'end_time', 'schedule_id'}
+
+
+class CommandResult(BaseModel):
+    """
+    Outcome of a single command of an ODSL script.
+    """
+    index: int
+    command_name: str
+    succeeded: bool
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+
+class ODSLExecutionError(Exception):
+    """
+    Raised when some commands of a script failed; `results` holds the outcome of every command.
+    """
+
+    def __init__(self, results: List[CommandResult]):
+        failed = [r for r in results if not r.succeeded]
+        details = '; '.join(f'#{r.index} {r.command_name}: {r.error}' for r in failed)
+        super().__init__(f'{len(failed)} of {len(results)} commands failed: {details}')
+        self.results = results
 
 
 class ODSLInterface(ABC):
@@ -31,15 +69,16 @@ class Command(ODSLInterface):
     command: str = Field(...)
     command_name: str = Field(...)
 
-    def __init__(self, command):
+    def __init__(self, command, client: Optional[O365Client] = None):
         """
         Initializes a new instance of the Command class.
 
         :param command: The command to be executed.
+        :param client: The Graph client to use, the shared one from client_provider by default.
         """
         self.command = command
         self.command_name = self.__cname__(command)
-        self.client = O365Client()
+        self.client = client or get_office_client()
 
     def execute(self, **kwargs):
         """
@@ -55,6 +94,24 @@ class Command(ODSLInterface):
         else:
             raise Exception('Command not found')
 
+    def to_batch_operation(self, **kwargs) -> dict:
+        """
+        Converts the command into an O365Client.outlook_event_batch operation.
+
+        :return: The batch operation.
+        """
+        if self.command_name == 'AddOutlookSchedule':
+            return {'method': 'add', 'subject': kwargs['description'],
+                    'start_time': self.__resolve_datetime__(kwargs['start_time']),
+                    'end_time': self.__resolve_datetime__(kwargs['end_time'])}
+        if self.command_name == 'ModifyOutlookSchedule':
+            return {'method': 'update', 'event_id': kwargs['schedule_id'], 'subject': kwargs['description'],
+                    'start_time': self.__resolve_datetime__(kwargs['start_time']),
+                    'end_time': self.__resolve_datetime__(kwargs['end_time'])}
+        if self.command_name == 'RemoveOutlookSchedule':
+            return {'method': 'delete', 'event_id': kwargs['schedule_id']}
+        raise Exception('Command not found')
+
     def __str_to_datetime__(self, datetime_str: str) -> datetime:
         """
         Converts a string representation of a datetime to a datetime object.
@@ -72,6 +129,17 @@ class Command(ODSLInterface):
                 logging.info(e)
                 raise Exception('Invalid datetime format')
     
+    def __resolve_datetime__(self, datetime_str: str) -> datetime:
+        """
+        Fills in today's date for the YYYY-MM-DD placeholder and converts the string to a datetime.
+
+        :param datetime_str: The string representation of the datetime.
+        :return: A datetime object.
+        """
+        if 'YYYY-MM-DD' in datetime_str:
+            datetime_str = datetime_str.replace('YYYY-MM-DD', str(date.today())) # str(date.today()) returns 2023-11-16
+        return self.__str_to_datetime__(datetime_str)
+
     def __cname__(self, o) -> str:
         """
         Gets the name of a class.
@@ -90,13 +158,8 @@ class Command(ODSLInterface):
         :param end_time: The end time of the schedule.
         """
         try:
-            if 'YYYY-MM-DD' in start_time:
-                start_time = start_time.replace('YYYY-MM-DD', str(date.today())) # str(date.today()) returns 2023-11-16
-            if 'YYYY-MM-DD' in end_time:
-                end_time = end_time.replace('YYYY-MM-DD', str(date.today()))
-                
-            start_time = self.__str_to_datetime__(start_time) # type: ignore
-            end_time = self.__str_to_datetime__(end_time) # type: ignore
+            start_time = self.__resolve_datetime__(start_time) # type: ignore
+            end_time = self.__resolve_datetime__(end_time) # type: ignore
 
             self.client.outlook_event_add(description, start_time, end_time) # type: ignore
             logging.info(f'Add Outlook schedule with subject {description} from {start_time} to {end_time}')
@@ -114,14 +177,9 @@ class Command(ODSLInterface):
         :param end_time: The new end time of the schedule.
         """
         try:
-            if 'YYYY-MM-DD' in start_time:
-                start_time = start_time.replace('YYYY-MM-DD', str(date.today()))
-            if 'YYYY-MM-DD' in end_time:
-                end_time = end_time.replace('YYYY-MM-DD', str(date.today()))
-
-            start_time = self.__str_to_datetime__(start_time) # type: ignore
-            end_time = self.__str_to_datetime__(end_time) # type: ignore
-            
+            start_time = self.__resolve_datetime__(start_time) # type: ignore
+            end_time = self.__resolve_datetime__(end_time) # type: ignore
+
             self.client.outlook_event_update(schedule_id, description, start_time, end_time) # type: ignore
             logging.info(f'{schedule_id}: Modify Outlook schedule with subject {description} from {start_time} to {end_time}')
         except Exception as e:
@@ -153,41 +211,302 @@ class Command(ODSLInterface):
         except Exception as e:
             logging.info(e)
             raise Exception('Failed to list up Outlook schedules')
-        
 
-def generate_odsl_execute(script_str: str):
+
+def get_metamodel(mm_def_path: str = ODSL_MODEL_PATH):
     """
-    Generates and executes ODSL commands.
+    Returns the compiled ODSL meta-model.
 
-    :param script: The ODSL script to be executed.
+    The meta-model is compiled at most once per process and is only rebuilt
+    when the modification time of the grammar file changes.
 
-    http://textx.github.io/textX/3.1/
-    https://github.com/textX/textX
+    :param mm_def_path: The path of the textX grammar file.
+    :return: The textX meta-model.
     """
-    try:
-        # Create meta-model from the grammar.
-        mm_def_path = os.path.join(os.path.dirname(__file__), 'odsl_model.txt')
+    mtime = os.path.getmtime(mm_def_path)
+    cached = _metamodel_cache.get(mm_def_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with _metamodel_lock:
+        # another thread may have compiled it while we were waiting
+        cached = _metamodel_cache.get(mm_def_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        logging.info(f'<get_metamodel>:compile {mm_def_path}')
         mm = metamodel_from_file(mm_def_path)
+        _metamodel_cache[mm_def_path] = (mtime, mm)
+        return mm
 
-        # script_str sample => add_outlook_schedule("Meeting with AB", "2023-11-16 9:00:00", "2023-11-16 10:00:00")
-        model = mm.model_from_str(script_str)
-        
-        # get paramters from model
-        logging.info('<generate_odsl_execute>')
+
+def warm_metamodel():
+    """
+    Compiles the ODSL meta-model ahead of the first request.
+    """
+    try:
+        get_metamodel()
+    except Exception as e:
+        logging.error(f'<warm_metamodel>:{e}')
+
+
+def parse_odsl(script_str: str):
+    """
+    Parses an ODSL script into a model.
+
+    The hand-written parser in odsl_parser handles the grammar directly; textX is only used
+    for inputs the fast path rejects, so invalid scripts still get textX's error reporting.
+
+    :param script_str: The ODSL script.
+    :return: The parsed model with a `commands` list.
+    """
+    try:
+        return odsl_parser.parse(script_str)
+    except odsl_parser.ODSLSyntaxError as e:
+        logging.info(f'<parse_odsl>:fallback to textX:{e}')
+        return get_metamodel().model_from_str(script_str)
+
+
+def command_kwargs(command) -> dict:
+    """
+    Returns the arguments of a parsed command that Command.execute accepts.
+
+    :param command: The parsed command.
+    :return: The keyword arguments.
+    """
+    return {k: v for k, v in vars(command).items() if k in COMMAND_ARGUMENTS}
+
+
+def command_dependencies(commands) -> List[List[int]]:
+    """
+    Builds the dependency graph of a script.
+
+    A command depends on the previous command that touches the same schedule id; all other
+    commands are independent of each other.
+
+    :param commands: The parsed commands.
+    :return: For every command, the indexes of the commands it depends on.
+    """
+    dependencies = []
+    last_command_by_id = {}
+    for idx, command in enumerate(commands):
+        schedule_id = getattr(command, 'schedule_id', None)
+        if schedule_id is not None and schedule_id in last_command_by_id:
+            dependencies.append([last_command_by_id[schedule_id]])
+        else:
+            dependencies.append([])
+        if schedule_id is not None:
+            last_command_by_id[schedule_id] = idx
+    return dependencies
+
+
+def _batch_error(body) -> str:
+    if isinstance(body, dict) and 'error' in body:
+        return body['error'].get('message', str(body['error']))
+    return str(body)
+
+
+def execute_odsl_batch(model, client: Optional[O365Client] = None) -> List[CommandResult]:
+    """
+    Executes the commands of a parsed ODSL model through Graph JSON batching.
+
+    Every command is attempted; commands on the same schedule id keep their script order, and a command
+    whose dependency could not be converted is not run, as in execute_odsl_parallel.
+
+    :param model: The parsed model.
+    :param client: The Graph client to use, the shared one from client_provider by default.
+    :return: The result of every command, in script order.
+    :raises ODSLExecutionError: If one or more commands failed.
+    """
+    client = client or get_office_client()
+    results: List[Optional[CommandResult]] = [None] * len(model.commands)
+    dependencies = command_dependencies(model.commands)
+    operations = []
+    operation_commands = []
+    operation_by_command = {}
+
+    for idx, command in enumerate(model.commands):
+        cl = Command(command, client)
+        failed = [dep for dep in dependencies[idx] if results[dep] is not None and not results[dep].succeeded]
+        if failed:
+            # as in execute_odsl_parallel, a command whose dependency failed is not run
+            results[idx] = CommandResult(index=idx, command_name=cl.command_name, succeeded=False,
+                                         error=f'Failed dependency #{failed[0]}')
+            continue
+        try:
+            operation = cl.to_batch_operation(**command_kwargs(command))
+        except Exception as e:
+            logging.info(f'<execute_odsl_batch>:#{idx}:{e}')
+            results[idx] = CommandResult(index=idx, command_name=cl.command_name, succeeded=False, error=str(e))
+            continue
+
+        depends_on = [operation_by_command[dep] for dep in dependencies[idx] if dep in operation_by_command]
+        if depends_on:
+            operation['depends_on'] = depends_on
+        operation_by_command[idx] = len(operations)
+        operations.append(operation)
+        operation_commands.append((idx, cl.command_name))
+
+    if operations:
+        try:
+            responses = client.outlook_event_batch(operations)
+        except Exception as e:
+            raise Exception('Failed to generate and execute ODSL commands: {}'.format(e))
+
+        for (idx, command_name), response in zip(operation_commands, responses):
+            if response is None:
+                results[idx] = CommandResult(index=idx, command_name=command_name, succeeded=False,
+                                             error='No response in batch')
+                continue
+            status = response['status']
+            succeeded = 200 <= status < 300
+            results[idx] = CommandResult(index=idx, command_name=command_name, succeeded=succeeded, status=status,
+                                         error=None if succeeded else _batch_error(response['body']))
+
+    logging.info('<execute_odsl_batch>')
+    logging.info(results)
+    if not all(result.succeeded for result in results):
+        raise ODSLExecutionError(results)
+    return results
+
+
+def format_results(results: List[CommandResult]) -> str:
+    """
+    Renders the outcome of every command of a script, e.g. for the failed commands of a partly failed batch.
+
+    :param results: The command results, in script order.
+    :return: One line per command.
+    """
+    lines = []
+    for result in results:
+        status = f' ({result.status})' if result.status is not None else ''
+        outcome = 'ok' if result.succeeded else f'failed: {result.error}'
+        lines.append(f'#{result.index} {result.command_name}{status} {outcome}')
+    return '\n'.join(lines)
+
+
+def _run_command(idx: int, command, client: O365Client) -> CommandResult:
+    cl = Command(command, client)
+    try:
+        cl.execute(**command_kwargs(command))
+        return CommandResult(index=idx, command_name=cl.command_name, succeeded=True)
+    except Exception as e:
+        logging.info(f'<execute_odsl_parallel>:#{idx}:{e}')
+        return CommandResult(index=idx, command_name=cl.command_name, succeeded=False, error=str(e))
+
+
+def execute_odsl_parallel(model, max_concurrency: Optional[int] = None,
+                          client: Optional[O365Client] = None) -> List[CommandResult]:
+    """
+    Executes the commands of a parsed ODSL model on a bounded thread pool.
+
+    Commands on the same schedule id run in script order, see command_dependencies; the rest
+    run concurrently. A command whose dependency failed is not run.
+
+    :param model: The parsed model.
+    :param max_concurrency: The maximum number of commands running at the same time,
+        [odsl] max_concurrency in the settings by default.
+    :param client: The Graph client to use, the shared one from client_provider by default.
+    :return: The result of every command, in script order.
+    :raises ODSLExecutionError: If one or more commands failed.
+    """
+    if max_concurrency is None:
+        max_concurrency = get_config().odsl.max_concurrency
+    client = client or get_office_client()
+    commands = model.commands
+    dependencies = command_dependencies(commands)
+    dependents = [[] for _ in commands]
+    remaining = [len(deps) for deps in dependencies]
+    for idx, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(idx)
+
+    results: List[Optional[CommandResult]] = [None] * len(commands)
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        pending = {pool.submit(_run_command, idx, commands[idx], client): idx
+                   for idx in range(len(commands)) if remaining[idx] == 0}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                results[idx] = future.result()
+                ready = list(dependents[idx])
+                while ready:
+                    nxt = ready.pop()
+                    remaining[nxt] -= 1
+                    if remaining[nxt] > 0:
+                        continue
+                    failed = [dep for dep in dependencies[nxt] if not results[dep].succeeded]
+                    if failed:
+                        # skip it, and release its own dependents so they are skipped too
+                        results[nxt] = CommandResult(index=nxt, command_name=commands[nxt].__class__.__name__,
+                                                     succeeded=False, error=f'Failed dependency #{failed[0]}')
+                        ready.extend(dependents[nxt])
+                    else:
+                        pending[pool.submit(_run_command, nxt, commands[nxt], client)] = nxt
+
+    logging.info('<execute_odsl_parallel>')
+    logging.info(results)
+    if not all(result.succeeded for result in results):
+        raise ODSLExecutionError(results)
+    return results
+
+
+def execute_odsl_model(model, mode: Optional[ExecutionMode] = None,
+                       client: Optional[O365Client] = None) -> List[CommandResult]:
+    """
+    Executes the commands of an already parsed ODSL model.
+
+    :param model: The model returned by parse_odsl, possibly with bound arguments.
+    :param mode: How to execute the commands. Single commands run serially; by default
+        longer scripts use [odsl] execution_mode in the settings, batching by default.
+    :param client: The Graph client to use, the shared one from client_provider by default.
+    :return: The result of every command, in script order.
+    """
+    if mode is None and len(model.commands) > 1:
+        mode = get_config().odsl.execution_mode
+    client = client or get_office_client()
+    if mode == ExecutionMode.BATCH:
+        return execute_odsl_batch(model, client)
+    if mode == ExecutionMode.PARALLEL:
+        return execute_odsl_parallel(model, client=client)
+
+    results = []
+    try:
+        logging.info('<execute_odsl_model>')
         logging.info(model)
 
         # Let's interpret the model
-        for command in model.commands:
-            logging.info('<generate_odsl_execute>:<command>')
+        for idx, command in enumerate(model.commands):
+            logging.info('<execute_odsl_model>:<command>')
             logging.info(vars(command))
 
-            cl = Command(command)
-            allowed_keys = {'description', 'start_time', 'end_time', 'schedule_id'}
-            kwargs = vars(command)   
-            filtered_kwargs = {k: v for k, v in kwargs.items() if k in allowed_keys}
+            cl = Command(command, client)
+            filtered_kwargs = command_kwargs(command)
 
             logging.info(cl.command_name)
             logging.info(filtered_kwargs)
             cl.execute(**filtered_kwargs)
+            results.append(CommandResult(index=idx, command_name=cl.command_name, succeeded=True))
+    except Exception as e:
+        raise Exception('Failed to generate and execute ODSL commands: {}'.format(e))
+    return results
+
+
+def generate_odsl_execute(script_str: str, client: Optional[O365Client] = None):
+    """
+    Generates and executes ODSL commands.
+
+    :param script: The ODSL script to be executed.
+    :param client: The Graph client to use, the shared one from client_provider by default.
+
+    http://textx.github.io/textX/3.1/
+    https://github.com/textX/textX
+    """
+    try:
+        # script_str sample => add_outlook_schedule("Meeting with AB", "2023-11-16 9:00:00", "2023-11-16 10:00:00")
+        model = parse_odsl(script_str)
     except Exception as e:
         raise Exception('Failed to generate and execute ODSL commands: {}'.format(e))
+
+    return execute_odsl_model(model, client=client)
@@ -0,0 +1,177 @@
+"""
+This module contains a hand-written parser for the ODSL grammar in odsl_model.txt.
+The grammar is a flat sequence of call forms, so a single pass over the input with a handful of
+precompiled regular expressions is enough to build the command objects that Command.execute expects.
+The node classes are named after the textX rules so that Command.__cname__ resolves them the same way.
+Inputs the parser cannot handle raise ODSLSyntaxError; the interpreter then falls back to textX.
+"""
+import re
+from typing import List, Tuple
+
+# Same whitespace set and STRING rule as textX/Arpeggio use by default.
+_WS = re.compile(r'[ \t\n\r]*')
+_NAME = re.compile(r'\w+')
+_STRING = re.compile(r'("(\\"|[^"])*")|(\'(\\\'|[^\'])*\')', re.MULTILINE)
+
+
+class ODSLSyntaxError(Exception):
+    """
+    Raised when the fast-path parser cannot handle an input.
+    """
+
+    def __init__(self, message: str, position: int):
+        super().__init__(f'{message} at position {position}')
+        self.position = position
+
+
+class ODSLNode:
+    """
+    Base class of the ODSL command nodes.
+    """
+    fields: Tuple[str, ...] = ()
+
+    def __init__(self, parent=None, **attrs):
+        self.parent = parent
+        for field in self.fields:
+            setattr(self, field, attrs[field])
+
+    def __repr__(self):
+        args = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.fields)
+        return f'{self.__class__.__name__}({args})'
+
+
+class AddOutlookSchedule(ODSLNode):
+    fields = ('description', 'start_time', 'end_time')
+
+
+class ModifyOutlookSchedule(ODSLNode):
+    fields = ('schedule_id', 'description', 'start_time', 'end_time')
+
+
+class RemoveOutlookSchedule(ODSLNode):
+    fields = ('schedule_id',)
+
+
+class ODSLModel:
+    """
+    Root of a parsed ODSL script, the counterpart of the textX `Model` rule.
+    """
+
+    def __init__(self, commands: List[ODSLNode]):
+        self.commands = commands
+
+    def __repr__(self):
+        return f'ODSLModel(commands={self.commands!r})'
+
+
+# keyword -> node class, mirrors the OutlookCommand rule
+COMMAND_NODES = {
+    'add_outlook_schedule': AddOutlookSchedule,
+    'modify_outlook_schedule': ModifyOutlookSchedule,
+    'remove_outlook_schedule': RemoveOutlookSchedule,
+}
+# rule name -> keyword, and keyword -> attribute order, for rendering parsed commands back to source
+COMMAND_KEYWORDS = {node_class.__name__: keyword for keyword, node_class in COMMAND_NODES.items()}
+COMMAND_FIELDS = {keyword: node_class.fields for keyword, node_class in COMMAND_NODES.items()}
+# ListOutlookSchedule has no attributes, so textX reduces it to the matched text instead of an object,
+# and an empty script gives back an empty string instead of a model. Both are left to textX.
+
+
+def _convert_string(token: str) -> str:
+    # textX STRING conversion: strip the quotes and unescape them
+    return token[1:-1].replace(r'\"', '"').replace(r"\'", "'")
+
+
+def parse(script_str: str) -> ODSLModel:
+    """
+    Parses an ODSL script.
+
+    :param script_str: The ODSL script, e.g. remove_outlook_schedule("5678").
+    :return: The parsed model.
+    :raises ODSLSyntaxError: If the input is not handled by the fast path.
+    """
+    model = ODSLModel([])
+    pos = _WS.match(script_str, 0).end()
+    end = len(script_str)
+    if pos == end:
+        raise ODSLSyntaxError('Empty script', pos)
+
+    while pos < end:
+        name_match = _NAME.match(script_str, pos)
+        node_class = COMMAND_NODES.get(name_match.group()) if name_match else None
+        if node_class is None:
+            raise ODSLSyntaxError('Expected a command name', pos)
+        pos = _WS.match(script_str, name_match.end()).end()
+
+        if not script_str.startswith('(', pos):
+            raise ODSLSyntaxError("Expected '('", pos)
+        pos = _WS.match(script_str, pos + 1).end()
+
+        attrs = {}
+        for idx, field in enumerate(node_class.fields):
+            if idx > 0:
+                if not script_str.startswith(',', pos):
+                    raise ODSLSyntaxError("Expected ','", pos)
+                pos = _WS.match(script_str, pos + 1).end()
+            string_match = _STRING.match(script_str, pos)
+            if string_match is None:
+                raise ODSLSyntaxError('Expected a string', pos)
+            attrs[field] = _convert_string(string_match.group())
+            pos = _WS.match(script_str, string_match.end()).end()
+
+        if not script_str.startswith(')', pos):
+            raise ODSLSyntaxError("Expected ')'", pos)
+        pos = _WS.match(script_str, pos + 1).end()
+
+        model.commands.append(node_class(parent=model, **attrs))
+
+    return model
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace('"', r'\"') + '"'
+
+
+def format_command(command) -> str:
+    """
+    Renders a parsed command back to ODSL source.
+
+    :param command: The parsed command, from either parser.
+    :return: The command as an ODSL call, e.g. remove_outlook_schedule("5678").
+    """
+    if isinstance(command, str):
+        # attribute-less rules come back from textX as their matched text
+        return command
+    keyword = COMMAND_KEYWORDS[command.__class__.__name__]
+    args = ', '.join(_quote(getattr(command, field)) for field in COMMAND_FIELDS[keyword])
+    return f'{keyword}({args})'
+
+
+def format_model(model) -> str:
+    """
+    Renders a parsed model back to ODSL source, one command per line.
+
+    :param model: The parsed model.
+    :return: The ODSL script.
+    """
+    return '\n'.join(format_command(command) for command in model.commands)
+
+
+def command_fields(command) -> dict:
+    """
+    Returns the grammar attributes of a command, for either a fast-path node or a textX object.
+
+    :param command: The parsed command.
+    :return: A dictionary of attribute name to value.
+    """
+    return {k: v for k, v in vars(command).items() if not k.startswith('_') and k != 'parent'}
+
+
+def model_signature(model) -> list:
+    """
+    Returns a comparable representation of a parsed model.
+
+    :param model: The model returned by either parser.
+    :return: A list of (command name, attributes) tuples.
+    """
+    return [(command.__class__.__name__, command_fields(command)) for command in model.commands]
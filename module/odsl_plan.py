@@ -0,0 +1,103 @@
+"""
+This module contains the planning stage of the ODSL interpreter.
+compile_plan turns the commands of a parsed (and bound) model into an ExecutionPlan before any Graph call is made,
+dropping commands that would not change the final state of the calendar:
+- a modify followed by another modify or a remove of the same schedule id,
+- an add followed by a remove that refers to it by its description,
+- exact duplicates of an earlier add, and repeated removes of the same schedule id.
+An ExecutionPlan exposes `commands` like a parsed model, so it can be passed to execute_odsl_model as is.
+"""
+from typing import List, Tuple
+from module.odsl_parser import format_command
+
+ADD = 'AddOutlookSchedule'
+MODIFY = 'ModifyOutlookSchedule'
+REMOVE = 'RemoveOutlookSchedule'
+
+
+class ExecutionPlan:
+    """
+    The commands left to execute, and the ones that were optimized away.
+    """
+
+    def __init__(self, commands: list, skipped: List[Tuple[int, object, str]]):
+        """
+        :param commands: The commands to execute, in script order.
+        :param skipped: (script index, command, reason) of every dropped command.
+        """
+        self.commands = commands
+        self.skipped = skipped
+
+    def __repr__(self):
+        return f'ExecutionPlan(commands={self.commands!r}, skipped={len(self.skipped)})'
+
+
+def _name(command) -> str:
+    return command.__class__.__name__
+
+
+def compile_plan(model) -> ExecutionPlan:
+    """
+    Compiles the commands of a parsed model into an optimized execution plan.
+
+    :param model: The parsed model, after schedule ids have been bound.
+    :return: The execution plan.
+    """
+    commands = list(model.commands)
+    dropped = {}
+    seen_adds = {}
+    pending_adds = {}
+    last_by_id = {}
+
+    for idx, command in enumerate(commands):
+        name = _name(command)
+
+        if name == ADD:
+            key = (command.description, command.start_time, command.end_time)
+            if key in seen_adds:
+                dropped[idx] = f'duplicate of #{seen_adds[key]}'
+                continue
+            seen_adds[key] = idx
+            pending_adds.setdefault(command.description, idx)
+
+        elif name == MODIFY:
+            previous = last_by_id.get(command.schedule_id)
+            if previous is not None and _name(commands[previous]) == MODIFY:
+                dropped[previous] = f'superseded by #{idx}'
+            last_by_id[command.schedule_id] = idx
+
+        elif name == REMOVE:
+            previous = last_by_id.get(command.schedule_id)
+            add_idx = pending_adds.get(command.schedule_id)
+            if previous is None and add_idx is not None:
+                # the event only exists within this script: add-then-remove is a no-op
+                dropped[add_idx] = f'removed by #{idx}'
+                dropped[idx] = f'cancels #{add_idx}'
+                del pending_adds[command.schedule_id]
+                del seen_adds[(commands[add_idx].description, commands[add_idx].start_time, commands[add_idx].end_time)]
+                continue
+            if previous is not None and _name(commands[previous]) == REMOVE:
+                dropped[idx] = f'duplicate of #{previous}'
+                continue
+            if previous is not None and _name(commands[previous]) == MODIFY:
+                dropped[previous] = f'superseded by #{idx}'
+            last_by_id[command.schedule_id] = idx
+
+    kept = [command for idx, command in enumerate(commands) if idx not in dropped]
+    skipped = [(idx, commands[idx], reason) for idx, reason in sorted(dropped.items())]
+    return ExecutionPlan(kept, skipped)
+
+
+def format_plan(plan: ExecutionPlan) -> str:
+    """
+    Renders an execution plan as a dry-run listing.
+
+    :param plan: The execution plan.
+    :return: The numbered commands to execute followed by the skipped ones.
+    """
+    lines = [f'{step}. {format_command(command)}' for step, command in enumerate(plan.commands, start=1)]
+    if not lines:
+        lines.append('Nothing to execute')
+    for idx, command, reason in plan.skipped:
+        lines.append(f'skip #{idx} {format_command(command)} ({reason})')
+    return '\n'.join(lines)
@@ -0,0 +1,459 @@
+"""
+This module contains the asynchronous Microsoft Graph client.
+AsyncO365Client implements the calendar operations of O365Client as coroutines on top of httpx, so several Graph
+calls can be in flight at once and a pending call can be cancelled. Every client of an event loop shares one
+httpx.AsyncClient and its keep-alive connection pool. O365Client in office_client_v2 is a blocking wrapper around it.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Optional, Union
+import httpx
+from module.app_config import AppConfig, get_config
+from module.calendar_mirror import CalendarMirror, get_calendar_mirror
+from module.graph_retry import (RETRY_STATUSES, AdaptiveLimiter, backoff_delay, get_limiter, retry_after,
+                                send_with_retry)
+from module.token_cache import TokenProvider, get_token_provider
+
+# Graph accepts at most 20 requests in a single JSON batch
+MAX_BATCH_SIZE = 20
+EVENT_BODY = "Scheduled by Outlook Agent"
+# Listing only transfers the fields shown to the user
+EVENT_LIST_FIELDS = "id,subject,start,end"
+# Graph caps calendar pages at 1000 events; an open-ended window is closed this many days after its start
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_WINDOW_DAYS = 365
+
+# event loop -> {(pool size, timeout, verify): httpx.AsyncClient}; an AsyncClient can only be used
+# from the loop it was first used on
+_http_clients = weakref.WeakKeyDictionary()
+_stats = {"requests": 0, "connections": 0}
+_stats_lock = threading.Lock()
+
+
+async def _trace(event_name: str, info: dict):
+    # httpcore reports every newly opened connection; requests on a reused connection skip this event
+    if event_name == "connection.connect_tcp.complete":
+        with _stats_lock:
+            _stats["connections"] += 1
+
+
+def get_http_client(pool_size: int, timeout: float, verify: Union[bool, str] = True) -> httpx.AsyncClient:
+    """
+    Returns the httpx.AsyncClient shared on the running event loop, creating it on first use.
+
+    Args:
+        pool_size (int): The maximum number of connections kept open.
+        timeout (float): Seconds before a request is abandoned.
+        verify (bool or str): TLS verification, or a CA bundle to trust.
+
+    Returns:
+        httpx.AsyncClient: The shared client.
+    """
+    clients = _http_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (pool_size, timeout, verify)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        client = clients[key] = httpx.AsyncClient(limits=limits, timeout=timeout, verify=verify)
+    return client
+
+
+def connection_stats() -> dict:
+    """
+    Returns connection reuse metrics of the shared HTTP clients.
+
+    Returns:
+        dict: "requests" sent, "connections" opened and "reused" requests that did not open a connection.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+    return stats
+
+
+class AsyncO365Client:
+    """
+    An asynchronous client for the calendar of the configured Microsoft Office 365 user.
+
+    Attributes:
+        config (AppConfig): The configuration of the client.
+    """
+
+    def __init__(self, config: Optional[AppConfig] = None):
+        """
+        Initializes the AsyncO365Client object.
+
+        Args:
+            config (AppConfig): A fixed configuration, by default the shared one from app_config,
+                which follows changes to the settings files.
+        """
+        self._config = config
+        # ((tenant, client id), TokenProvider) of the last request, so a changed app registration gets a new provider
+        self._token_provider: Optional[tuple] = None
+
+    @property
+    def config(self) -> AppConfig:
+        return self._config if self._config is not None else get_config()
+
+    def __token_provider__(self) -> TokenProvider:
+        """
+        Returns the process-wide MSAL token cache of the configured app registration.
+        """
+        config = self.config
+        return get_token_provider(
+            authority=f"{config.graph.authority_host}/{config.default.tenant}",
+            client_id=config.client_credentials.client_id,
+            client_secret=config.client_credentials.client_secret,
+            cache_path=config.resolve_path(config.token_cache.path) if config.token_cache.path else None,
+            refresh_margin=config.token_cache.refresh_margin,
+            verify=config.graph.ca_bundle or True
+        )
+
+    async def __auth_headers__(self) -> dict:
+        config = self.config
+        key = (config.default.tenant, config.client_credentials.client_id)
+        provider = self._token_provider[1] if self._token_provider and self._token_provider[0] == key else None
+        token = provider.cached_token() if provider is not None else None
+        if token is None:
+            # MSAL is blocking, including the authority discovery of a new provider; run it off the event loop
+            provider = await asyncio.to_thread(self.__token_provider__)
+            self._token_provider = (key, provider)
+            token = await asyncio.to_thread(provider.get_token)
+        return {"Authorization": f"Bearer {token['access_token']}"}
+
+    async def __request__(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends an authenticated request over the shared connection pool and raises on an error status.
+        """
+        config = self.config
+        client = get_http_client(config.http.pool_size, config.http.timeout, config.graph.ca_bundle or True)
+        headers = kwargs.pop("headers", {})
+
+        async def send() -> httpx.Response:
+            # re-read the token on every attempt, a retry may outlive it
+            headers.update(await self.__auth_headers__())
+            with _stats_lock:
+                _stats["requests"] += 1
+            return await client.request(method, url, headers=headers, extensions={"trace": _trace}, **kwargs)
+
+        response = await send_with_retry(send, self.__limiter__(), **self.__retry_settings__())
+        response.raise_for_status()
+        return response
+
+    def __limiter__(self) -> AdaptiveLimiter:
+        """
+        Returns the concurrency limiter of the running event loop, capped at the connection pool size.
+        """
+        return get_limiter(self.config.http.pool_size)
+
+    def __retry_settings__(self) -> dict:
+        """
+        Returns the send_with_retry options configured in [retry].
+        """
+        return self.config.retry.model_dump()
+
+    async def __get_json__(self, url: str, params: Optional[dict] = None) -> dict:
+        response = await self.__request__("GET", url, params=params)
+        return response.json()
+
+    async def __get_delta_json__(self, url: str, params: Optional[dict] = None) -> dict:
+        # delta queries take no $top; without this preference Graph pages them 10 events at a time
+        response = await self.__request__("GET", url, params=params,
+                                          headers={"Prefer": f"odata.maxpagesize={MAX_PAGE_SIZE}"})
+        return response.json()
+
+    async def __send_event_request__(self, operation: dict) -> httpx.Response:
+        request = self.__event_request__(operation)
+        return await self.__request__(request["method"], self.config.graph.endpoint + request["url"],
+                                      json=request.get("body"))
+
+    async def outlook_event_add(self, subject: str, start_time: datetime, end_time: datetime) -> str:
+        """
+        Adds a new event to the user's Outlook calendar.
+
+        Args:
+            subject (str): The subject of the event.
+            start_time (datetime): The start time of the event.
+            end_time (datetime): The end time of the event.
+
+        Returns:
+            str: The ID of the newly created event.
+        """
+        response = await self.__send_event_request__({"method": "add", "subject": subject,
+                                                      "start_time": start_time, "end_time": end_time})
+        event_id = response.json()["id"]
+        self.__mirror_write__(event_id, subject, start_time, end_time)
+        return event_id
+
+    async def outlook_event_update(self, event_id: str, subject: str, start_time: datetime, end_time: datetime):
+        """
+        Updates an existing event in the user's Outlook calendar.
+
+        Args:
+            event_id (str): The ID of the event to update.
+            subject (str): The new subject of the event.
+            start_time (datetime): The new start time of the event.
+            end_time (datetime): The new end time of the event.
+        """
+        await self.__send_event_request__({"method": "update", "event_id": event_id, "subject": subject,
+                                           "start_time": start_time, "end_time": end_time})
+        self.__mirror_write__(event_id, subject, start_time, end_time)
+
+    async def outlook_event_delete(self, schedule_id: str):
+        """
+        Deletes an event from the user's Outlook calendar.
+
+        Args:
+            schedule_id (str): The ID of the event to delete.
+        """
+        await self.__send_event_request__({"method": "delete", "event_id": schedule_id})
+        self.__mirror_write__(schedule_id, deleted=True)
+
+    async def iter_outlook_events(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                  page_size: int = DEFAULT_PAGE_SIZE) -> AsyncIterator[dict]:
+        """
+        Lazily iterates over the events of the user's Outlook calendar, ordered by start time.
+
+        Without a window the whole calendar is listed; with a window the calendarView of that
+        window is listed, which also expands recurring events. Pages of `page_size` events are
+        only requested as the iteration reaches them.
+
+        Args:
+            start (datetime): The start of the window (UTC). Defaults to now when only `end` is given.
+            end (datetime): The end of the window (UTC). Defaults to DEFAULT_WINDOW_DAYS after `start`.
+            page_size (int): The number of events requested per page.
+
+        Yields:
+            dict: The "no", "id", "subject", "start" and "end" of each event.
+        """
+        my_user_id = self.config.user_credentials.username
+        params = {"$select": EVENT_LIST_FIELDS, "$orderby": "start/dateTime",
+                  "$top": str(max(1, min(page_size, MAX_PAGE_SIZE)))}
+
+        if start is None and end is None:
+            url = f"{self.config.graph.endpoint}/users/{my_user_id}/calendar/events"
+        else:
+            start = start or datetime.utcnow()
+            end = end or start + timedelta(days=DEFAULT_WINDOW_DAYS)
+            url = f"{self.config.graph.endpoint}/users/{my_user_id}/calendar/calendarView"
+            params["startDateTime"] = self.__utc_iso__(start)
+            params["endDateTime"] = self.__utc_iso__(end)
+
+        idx = 0
+        while url:
+            page = await self.__get_json__(url, params)
+            for event in page.get("value", []):
+                yield {
+                    "no": str(idx),
+                    "id": event["id"],
+                    "subject": event.get("subject"),
+                    "start": event["start"]["dateTime"],
+                    "end": event["end"]["dateTime"]
+                }
+                idx += 1
+            # the next link already carries the query options
+            url = page.get("@odata.nextLink")
+            params = None
+
+    async def outlook_event_list(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                 top: Optional[int] = None) -> list:
+        """
+        Retrieves a list of events from the user's Outlook calendar.
+
+        Args:
+            start (datetime): Optional start of the window, see iter_outlook_events.
+            end (datetime): Optional end of the window, see iter_outlook_events.
+            top (int): Optional maximum number of events, e.g. the next 10 events with start=now.
+
+        Returns:
+            list: A list of dictionaries containing information about each event.
+        """
+        mirror = self.__calendar_mirror__()
+        if mirror is not None and (start is not None or end is not None):
+            window_start = start or datetime.utcnow()
+            window_end = end or window_start + timedelta(days=DEFAULT_WINDOW_DAYS)
+            my_user_id = self.config.user_credentials.username
+            delta_url = f"{self.config.graph.endpoint}/users/{my_user_id}/calendar/calendarView/delta"
+            try:
+                await mirror.sync(self.__get_delta_json__, delta_url)
+            except httpx.HTTPError as e:
+                # list straight from Graph until the mirror can sync again
+                logging.error(f"<AsyncO365Client.outlook_event_list>:mirror sync failed: {e}")
+            else:
+                if mirror.covers(window_start, window_end):
+                    return mirror.list_events(window_start, window_end, top)
+
+        page_size = min(top, MAX_PAGE_SIZE) if top else DEFAULT_PAGE_SIZE
+        events = []
+        async for event in self.iter_outlook_events(start, end, page_size):
+            events.append(event)
+            if top and len(events) >= top:
+                break
+        return events
+
+    async def outlook_event_batch(self, operations: List[dict]) -> List[dict]:
+        """
+        Runs add, update and delete operations through Graph JSON batching.
+
+        Operations are sent in batches of up to MAX_BATCH_SIZE requests. An operation can list the
+        indexes of earlier operations it depends on; Graph runs those first when they are in the
+        same batch, and earlier batches always complete before later ones are sent. Throttled
+        operations, and those that failed because a throttled one did, are sent again after the
+        Retry-After of the batch response.
+
+        Args:
+            operations (list): Dictionaries with a "method" of "add", "update" or "delete",
+                the event fields of that method ("subject", "start_time", "end_time", "event_id")
+                and an optional "depends_on" list of operation indexes.
+
+        Returns:
+            list: One dictionary per operation, in order, with the HTTP "status" and the response "body".
+        """
+        results = [None] * len(operations)
+
+        retry_settings = self.__retry_settings__()
+
+        for offset in range(0, len(operations), MAX_BATCH_SIZE):
+            pending = list(range(offset, min(offset + MAX_BATCH_SIZE, len(operations))))
+            attempt = 0
+            while pending:
+                batch_requests = []
+                for idx in pending:
+                    request = self.__batch_request__(str(idx), operations[idx])
+                    depends_on = [str(dep) for dep in operations[idx].get("depends_on", []) if dep in pending]
+                    if depends_on:
+                        request["dependsOn"] = depends_on
+                    batch_requests.append(request)
+
+                response = await self.__request__("POST", f"{self.config.graph.endpoint}/$batch",
+                                                  json={"requests": batch_requests})
+                delays = []
+                for item in response.json().get("responses", []):
+                    results[int(item["id"])] = {"status": item.get("status"), "body": item.get("body")}
+                    if item.get("status") in RETRY_STATUSES:
+                        delays.append(retry_after(item.get("headers")))
+
+                throttled = set()
+                for idx in pending:
+                    status = results[idx]["status"] if results[idx] else None
+                    # 424 Failed Dependency: the operation never ran because an operation it depends on failed
+                    if status in RETRY_STATUSES or (status == 424 and throttled.intersection(
+                            operations[idx].get("depends_on", []))):
+                        throttled.add(idx)
+                if not throttled or attempt >= retry_settings["max_retries"]:
+                    break
+
+                self.__limiter__().on_throttle()
+                delay = max((d for d in delays if d is not None), default=None)
+                if delay is None:
+                    delay = backoff_delay(attempt, retry_settings["base_delay"], retry_settings["max_delay"])
+                logging.info(f'<AsyncO365Client.outlook_event_batch>:{len(throttled)} throttled, '
+                             f'retrying in {delay:.2f}s')
+                await asyncio.sleep(delay)
+                pending = sorted(throttled)
+                attempt += 1
+
+        for operation, result in zip(operations, results):
+            if result is None or not 200 <= result["status"] < 300:
+                continue
+            if operation["method"] == "delete":
+                self.__mirror_write__(operation["event_id"], deleted=True)
+            else:
+                event_id = operation.get("event_id") or (result["body"] or {}).get("id")
+                self.__mirror_write__(event_id, operation["subject"], operation["start_time"], operation["end_time"])
+
+        return results
+
+    def __calendar_mirror__(self) -> Optional[CalendarMirror]:
+        """
+        Returns the local calendar mirror configured in [mirror], or None when it is disabled.
+        """
+        config = self.config
+        if not config.mirror.enabled:
+            return None
+        return get_calendar_mirror(
+            config.resolve_path(config.mirror.path),
+            past_days=config.mirror.past_days,
+            future_days=config.mirror.future_days,
+            sync_interval=config.mirror.sync_interval
+        )
+
+    def __mirror_write__(self, event_id: str, subject: Optional[str] = None, start_time: Optional[datetime] = None,
+                         end_time: Optional[datetime] = None, deleted: bool = False):
+        mirror = self.__calendar_mirror__()
+        if mirror is not None and event_id:
+            mirror.apply_write(event_id, subject, start_time, end_time, deleted)
+
+    @staticmethod
+    def __utc_iso__(value: datetime) -> str:
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @staticmethod
+    def __date_time_time_zone__(value: datetime) -> dict:
+        """
+        Formats a naive datetime as a Graph dateTimeTimeZone in UTC.
+        """
+        return {"dateTime": value.replace(tzinfo=timezone.utc).isoformat(), "timeZone": "UTC"}
+
+    def __event_request__(self, operation: dict) -> dict:
+        """
+        Builds the Graph request of a single add, update or delete operation.
+
+        Args:
+            operation (dict): The operation, see outlook_event_batch.
+
+        Returns:
+            dict: The "method", the "url" relative to the Graph endpoint and, except for deletes, the JSON "body".
+        """
+        my_user_id = self.config.user_credentials.username
+        events_url = f"/users/{my_user_id}/calendar/events"
+        method = operation["method"]
+
+        if method == "add":
+            return {
+                "method": "POST",
+                "url": events_url,
+                "body": {
+                    "subject": operation["subject"],
+                    "body": {"contentType": "Text", "content": EVENT_BODY},
+                    "start": self.__date_time_time_zone__(operation["start_time"]),
+                    "end": self.__date_time_time_zone__(operation["end_time"]),
+                    "attendees": [{"emailAddress": {"address": my_user_id}, "type": "required"}],
+                },
+            }
+        elif method == "update":
+            return {
+                "method": "PATCH",
+                "url": f"{events_url}/{operation['event_id']}",
+                "body": {
+                    "subject": operation["subject"],
+                    "start": self.__date_time_time_zone__(operation["start_time"]),
+                    "end": self.__date_time_time_zone__(operation["end_time"]),
+                },
+            }
+        elif method == "delete":
+            return {"method": "DELETE", "url": f"{events_url}/{operation['event_id']}"}
+        raise ValueError(f"Unsupported batch operation: {method}")
+
+    def __batch_request__(self, request_id: str, operation: dict) -> dict:
+        """
+        Builds a single request of a JSON batch.
+
+        Args:
+            request_id (str): The id of the request within the batch.
+            operation (dict): The operation, see outlook_event_batch.
+
+        Returns:
+            dict: The batch request.
+        """
+        request = self.__event_request__(operation)
+        request["id"] = request_id
+        if "body" in request:
+            request["headers"] = {"Content-Type": "application/json"}
+        return request
@@ -1,58 +1,94 @@
 
-from office365.graph_client import GraphClient
-from configparser import ConfigParser
+import asyncio
+import threading
+from concurrent.futures import Future
 from datetime import datetime
-from dotenv import load_dotenv
-import msal
-import os
+from typing import Awaitable, Iterator, List, Optional
+from module.app_config import AppConfig
+from module.graph_retry import retry_stats
+from module.office_client_async import AsyncO365Client, DEFAULT_PAGE_SIZE, connection_stats
+
+# one event loop thread runs the Graph I/O of every blocking O365Client
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the background event loop of the blocking clients, starting its thread on first use.
+    """
+    global _loop
+    loop = _loop
+    if loop is None:
+        with _loop_lock:
+            if _loop is None:
+                new_loop = asyncio.new_event_loop()
+                threading.Thread(target=new_loop.run_forever, name="o365-client-loop", daemon=True).start()
+                _loop = new_loop
+            loop = _loop
+    return loop
 
 
 class O365Client:
     """
     A class for interacting with the Microsoft Office 365 API.
+    Each call runs the matching AsyncO365Client coroutine on a shared background event loop and waits for it.
 
     Attributes:
-        settings (ConfigParser): A ConfigParser object containing the settings for the API client.
+        async_client (AsyncO365Client): The asynchronous client doing the Graph I/O.
     """
 
-    def __init__(self):
+    def __init__(self, config: Optional[AppConfig] = None):
         """
         Initializes the O365Client object.
+
+        Args:
+            config (AppConfig): A fixed configuration, by default the shared one from app_config.
+        """
+        self.async_client = AsyncO365Client(config)
+
+    @property
+    def config(self) -> AppConfig:
+        """
+        The configuration of the client, see AsyncO365Client.config.
         """
-        load_dotenv(verbose=False)
-        self.settings = self.__load_settings__()
+        return self.async_client.config
 
     @staticmethod
-    def __load_settings__() -> ConfigParser:
+    def connection_stats() -> dict:
         """
-        Loads the settings from the configuration file.
+        Returns connection reuse metrics of the shared HTTP clients, see office_client_async.connection_stats.
+        """
+        return connection_stats()
+
+    @staticmethod
+    def retry_stats() -> dict:
+        """
+        Returns the retry and throttling counters, see graph_retry.retry_stats.
+        """
+        return retry_stats()
+
+    def submit(self, coro: Awaitable) -> Future:
+        """
+        Starts a coroutine of async_client on the background loop without waiting for it,
+        so the caller can do other work, e.g. an LLM call, while the Graph request is in flight.
+
+        Args:
+            coro (Awaitable): The coroutine, e.g. client.async_client.outlook_event_list(top=20).
 
         Returns:
-            ConfigParser: A ConfigParser object containing the settings.
-        """
-        cp = ConfigParser()
-        mode = os.getenv("PROD_DEV")
-        current_file_path = os.path.dirname(os.path.abspath(__file__))
-        parent_dir = os.path.dirname(current_file_path)
-        config_file = os.path.join(parent_dir, "settings.dev.cfg" if mode == "DEV" else "settings.cfg")
-        cp.read(config_file)
-
-        return cp
-    
-    def __acquire_token_by_client_credentials__(self) -> dict:
-        """
-        Acquire token via MSAL
-        """
-        settings = self.settings
-        print(settings)
-        authority_url = f'https://login.microsoftonline.com/{settings.get("default", "tenant")}'
-        app = msal.ConfidentialClientApplication(
-            authority=authority_url,
-            client_id=settings.get("client_credentials", "client_id"),
-            client_credential=settings.get("client_credentials", "client_secret")
-        )
-        token = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
-        return token
+            Future: A concurrent.futures.Future of the result; cancelling it cancels the request.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+    def __run__(self, coro: Awaitable):
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt or a stopped script run: do not leave the request running
+            future.cancel()
+            raise
 
     def outlook_event_add(self, subject: str, start_time: datetime, end_time: datetime) -> str:
         """
@@ -66,18 +102,7 @@ class O365Client:
         Returns:
             str: The ID of the newly created event.
         """
-        client = GraphClient(self.__acquire_token_by_client_credentials__)
-        my_user_id = self.settings.get("user_credentials", "username")
-        new_event = client.users[my_user_id].calendar.events.add(
-            subject=subject,
-            body="Scheduled by Outlook Agent",
-            start=start_time,
-            end=end_time,
-            attendees=[my_user_id],
-        )
-        new_event.execute_query()
-        return new_event.id
-    
+        return self.__run__(self.async_client.outlook_event_add(subject, start_time, end_time))
 
     def outlook_event_update(self, event_id: str, subject: str, start_time: datetime, end_time: datetime):
         """
@@ -89,15 +114,7 @@ class O365Client:
             start_time (datetime): The new start time of the event.
             end_time (datetime): The new end time of the event.
         """
-        client = GraphClient(self.__acquire_token_by_client_credentials__)
-        my_user_id = self.settings.get("user_credentials", "username")
-        event_to_update = client.users[my_user_id].calendar.events[event_id]
-        event_to_update.subject = subject
-        event_to_update.start = start_time
-        event_to_update.end = end_time
-        # property 'attendees' of 'Event' object has no setter
-        event_to_update.update().execute_query()
-
+        self.__run__(self.async_client.outlook_event_update(event_id, subject, start_time, end_time))
 
     def outlook_event_delete(self, schedule_id: str):
         """
@@ -106,31 +123,63 @@ class O365Client:
         Args:
             schedule_id (str): The ID of the event to delete.
         """
-        client = GraphClient(self.__acquire_token_by_client_credentials__)
-        my_user_id = self.settings.get("user_credentials", "username")
-        event_id = schedule_id
-        event_to_del = client.users[my_user_id].calendar.events[event_id]
-        event_to_del.delete_object().execute_query()
+        self.__run__(self.async_client.outlook_event_delete(schedule_id))
 
+    def iter_outlook_events(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                            page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Lazily iterates over the events of the user's Outlook calendar, ordered by start time.
+        See AsyncO365Client.iter_outlook_events.
 
-    def outlook_event_list(self) -> list:
+        Yields:
+            dict: The "no", "id", "subject", "start" and "end" of each event.
+        """
+        events = self.async_client.iter_outlook_events(start, end, page_size)
+        try:
+            while True:
+                try:
+                    yield self.__run__(events.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.__run__(events.aclose())
+
+    def outlook_event_list(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                           top: Optional[int] = None) -> list:
         """
         Retrieves a list of events from the user's Outlook calendar.
 
+        Args:
+            start (datetime): Optional start of the window, see iter_outlook_events.
+            end (datetime): Optional end of the window, see iter_outlook_events.
+            top (int): Optional maximum number of events, e.g. the next 10 events with start=now.
+
         Returns:
             list: A list of dictionaries containing information about each event.
         """
-        events_payload = []
-        client = GraphClient(self.__acquire_token_by_client_credentials__)
-        my_user_id = self.settings.get("user_credentials", "username")
-        events = client.users[my_user_id].calendar.events.get_all().select(["id", "subject", "body", "start", "end"]).execute_query()
-        for idx, event in enumerate(events):
-            # print(event.id, event.subject)
-            events_payload.append({
-                "no": str(idx),
-                "id": event.id,
-                "subject": event.subject,
-                "start": event.start.dateTime,
-                "end": event.end.dateTime
-            })
-        return events_payload
+        return self.__run__(self.async_client.outlook_event_list(start, end, top))
+
+    def submit_event_list(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          top: Optional[int] = None) -> Future:
+        """
+        Like outlook_event_list, but returns without waiting for the list, e.g. to prefetch it during an LLM call.
+
+        Args:
+            start (datetime): Optional start of the window, see iter_outlook_events.
+            end (datetime): Optional end of the window, see iter_outlook_events.
+            top (int): Optional maximum number of events.
+
+        Returns:
+            Future: A concurrent.futures.Future of the list; cancelling it cancels the request.
+        """
+        return self.submit(self.async_client.outlook_event_list(start, end, top))
+
+    def outlook_event_batch(self, operations: List[dict]) -> List[dict]:
+        """
+        Runs add, update and delete operations through Graph JSON batching.
+        See AsyncO365Client.outlook_event_batch.
+
+        Returns:
+            list: One dictionary per operation, in order, with the HTTP "status" and the response "body".
+        """
+        return self.__run__(self.async_client.outlook_event_batch(operations))
@@ -4,6 +4,7 @@ This module contains classes for generating prompts for different types of tasks
 The PromptType class is the base class for all prompt types and contains a method to get the prompt message.
 The ODSLPrompt class generates a prompt for creating commands related to scheduling, modifying, and removing meetings in Microsoft Outlook.
 The UserIntentPrompt class generates a prompt for identifying the user's intent from their query related to Outlook schedules.
+The IntentODSLPrompt class combines the two, so one request returns the user's intent and the commands as JSON.
 The ScheduleIdEntityPrompt class generates a prompt for identifying the schedule ID from the provided function calls related to Outlook schedules.
 The return_prompt function returns the prompt message based on the prompt type.
 """
@@ -170,6 +171,23 @@ class ScheduleIdEntityPrompt(PromptType):
         super().__init__(GeneratePrompt.SCHEDULE_ID.value, self.promptMessage)
 
 
+class IntentODSLPrompt(PromptType):
+    promptMessage = UserIntentPrompt.promptMessage + ODSLPrompt.promptMessage + '''
+    # Combined Output:
+    You perform both tasks above for the last user query at once. These instructions replace both output instructions above.
+    Respond with a single JSON object and nothing else:
+
+    {"intent": <the intent number>, "odsl": "<the commands, or your answer when you cannot create commands>"}
+
+    - "intent" is one of 1, 2, 3, 4 or 5, decided as described in the intent instructions.
+    - "odsl" holds the commands without backticks, e.g. remove_outlook_schedule(\\"5678\\"), with the quotes escaped as JSON requires.
+    - When the intent is 4, "odsl" is an empty string.
+    '''
+
+    def __init__(self):
+        super().__init__(GeneratePrompt.INTENT_ODSL.value, self.promptMessage)
+
+
 def return_prompt(prompt_type) -> str:
     """
     Returns the prompt message based on the prompt type.
@@ -183,7 +201,8 @@ def return_prompt(prompt_type) -> str:
     prompt_types = {
         GeneratePrompt.ODSL.value: ODSLPrompt,
         GeneratePrompt.INTENT.value: UserIntentPrompt,
-        GeneratePrompt.SCHEDULE_ID.value: ScheduleIdEntityPrompt
+        GeneratePrompt.SCHEDULE_ID.value: ScheduleIdEntityPrompt,
+        GeneratePrompt.INTENT_ODSL.value: IntentODSLPrompt
     }
 
     if prompt_type in prompt_types:
@@ -0,0 +1,181 @@
+"""
+This module contains the process-wide pool of chat sessions shared by the front ends.
+Every session gets its own ChatBot, but all ChatBots share the O365Client from client_provider, and with it the HTTP
+connection pool and the MSAL token cache, the intent classifier and the AzureOpenAI client of method_util.
+The pool caps the calls in flight per session, trims each session's history after every call and evicts sessions
+that were idle longer than [sessions] idle_timeout, or the least recently used ones beyond max_sessions,
+so memory stays bounded however many browser tabs are open.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+from module.app_config import SessionSettings, get_config
+from module.chat_flow import ChatBot
+
+# Minimum seconds between two sweeps for idle sessions
+EVICTION_INTERVAL = 10.0
+
+
+class SessionBusyError(Exception):
+    """
+    Raised when a session already has [sessions] max_in_flight calls in flight.
+    """
+
+
+class SessionNotFoundError(Exception):
+    """
+    Raised when a session id is not in the pool, e.g. after it was removed or evicted.
+    """
+
+
+class ChatSession:
+    """
+    A chat session of the pool.
+
+    Attributes:
+        chatbot (ChatBot): The session's chatbot.
+        last_used (float): time.monotonic() of the last use.
+        in_flight (int): The number of calls in flight.
+        slots (BoundedSemaphore): The free in-flight slots.
+    """
+
+    def __init__(self, chatbot: ChatBot, max_in_flight: int):
+        self.chatbot = chatbot
+        self.last_used = time.monotonic()
+        self.in_flight = 0
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+
+
+class SessionPool:
+    """
+    The chat sessions of the process, by session id.
+    """
+
+    def __init__(self, chatbot_factory: Callable[[], ChatBot] = ChatBot, settings: Optional[SessionSettings] = None):
+        """
+        Initializes the SessionPool object.
+
+        Args:
+            chatbot_factory (callable): Creates the ChatBot of a new session.
+            settings (SessionSettings): Fixed [sessions] settings, by default the shared ones from app_config.
+        """
+        self.chatbot_factory = chatbot_factory
+        self._settings = settings
+        self._sessions: Dict[str, ChatSession] = {}
+        self._lock = threading.Lock()
+        self._swept_at = time.monotonic()
+        self._stats = {"created": 0, "evicted": 0, "rejected": 0}
+
+    @property
+    def settings(self) -> SessionSettings:
+        return self._settings or get_config().sessions
+
+    def get(self, session_id: str, create: bool = True) -> ChatSession:
+        """
+        Returns the session of an id, creating it on first use or after it was evicted.
+
+        Args:
+            session_id (str): The session id.
+            create (bool): Whether to create a missing session.
+
+        Returns:
+            ChatSession: The session.
+
+        Raises:
+            SessionNotFoundError: If the session is missing and create is not set.
+        """
+        settings = self.settings
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                if not create:
+                    raise SessionNotFoundError(f'Session {session_id} not found')
+                session = ChatSession(self.chatbot_factory(), settings.max_in_flight)
+                self._stats["created"] += 1
+            # most recently used last
+            self._sessions[session_id] = session
+            session.last_used = time.monotonic()
+        self.evict_idle()
+        return session
+
+    @contextmanager
+    def acquire(self, session_id: str, create: bool = True) -> Iterator[ChatBot]:
+        """
+        Holds one of the session's in-flight slots while the caller uses its ChatBot.
+
+        Args:
+            session_id (str): The session id.
+            create (bool): Whether to create a missing session.
+
+        Yields:
+            ChatBot: The session's chatbot.
+
+        Raises:
+            SessionBusyError: If the session has no free slot.
+            SessionNotFoundError: If the session is missing and create is not set.
+        """
+        session = self.get(session_id, create)
+        if not session.slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise SessionBusyError(f'Session {session_id} has too many requests in flight')
+        with self._lock:
+            session.in_flight += 1
+        try:
+            yield session.chatbot
+        finally:
+            session.chatbot.trim_conversation_history(self.settings.max_history)
+            with self._lock:
+                session.in_flight -= 1
+                session.last_used = time.monotonic()
+            session.slots.release()
+
+    def remove(self, session_id: str) -> bool:
+        # whether the session was in the pool
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def evict_idle(self, force: bool = False) -> int:
+        """
+        Evicts the sessions idle for longer than idle_timeout, and the least recently used beyond max_sessions.
+        Sessions with calls in flight are kept. Sweeps run at most every EVICTION_INTERVAL seconds unless forced.
+
+        Returns:
+            int: The number of evicted sessions.
+        """
+        settings, now = self.settings, time.monotonic()
+        with self._lock:
+            if not force and now - self._swept_at < EVICTION_INTERVAL and len(self._sessions) <= settings.max_sessions:
+                return 0
+            self._swept_at = now
+            idle = [session_id for session_id, session in self._sessions.items()
+                    if session.in_flight == 0 and now - session.last_used > settings.idle_timeout]
+            for session_id in idle:
+                del self._sessions[session_id]
+            overflow = len(self._sessions) - settings.max_sessions
+            if overflow > 0:
+                # the dict is ordered from least to most recently used
+                lru = [session_id for session_id, session in self._sessions.items() if session.in_flight == 0]
+                for session_id in lru[:overflow]:
+                    del self._sessions[session_id]
+                    idle.append(session_id)
+            self._stats["evicted"] += len(idle)
+        if idle:
+            logging.info(f'<SessionPool.evict_idle>:{len(idle)} sessions evicted')
+        return len(idle)
+
+    def stats(self) -> dict:
+        """
+        Returns the pool counters.
+
+        Returns:
+            dict: The live "sessions", the calls "in_flight", and the sessions "created", "evicted"
+                and the calls "rejected" since the start.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["in_flight"] = sum(session.in_flight for session in self._sessions.values())
+        return stats
@@ -0,0 +1,179 @@
+"""
+This module contains the shared MSAL token cache used by O365Client.
+A TokenProvider owns one msal.ConfidentialClientApplication per app registration, keeps the current access token in memory,
+and refreshes it on a background timer shortly before it expires, so Graph calls normally never wait for token acquisition.
+The MSAL cache can optionally be persisted to a file so a restarted process reuses a still valid token.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional, Union
+from urllib.parse import urlparse
+import msal
+import msal.authority
+import requests
+
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+# Refresh this many seconds before the token expires.
+DEFAULT_REFRESH_MARGIN = 600
+
+
+class TokenProvider:
+    """
+    Acquires and caches client-credential tokens for one app registration.
+
+    Attributes:
+        refresh_margin (int): Seconds before expiry at which the token is refreshed.
+    """
+
+    def __init__(self, authority: str, client_id: str, client_secret: str,
+                 cache_path: Optional[str] = None, refresh_margin: int = DEFAULT_REFRESH_MARGIN,
+                 verify: Union[bool, str] = True):
+        """
+        Initializes the TokenProvider object.
+
+        Args:
+            authority (str): The authority URL, e.g. https://login.microsoftonline.com/{tenant}.
+            client_id (str): The application (client) id.
+            client_secret (str): The client secret.
+            cache_path (str): Optional file used to persist the MSAL token cache.
+            refresh_margin (int): Seconds before expiry at which the token is refreshed.
+            verify (bool or str): TLS verification of the authority, or a CA bundle to trust.
+        """
+        self.refresh_margin = refresh_margin
+        self._cache_path = cache_path
+        self._cache = msal.SerializableTokenCache()
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                self._cache.deserialize(f.read())
+        http_client = None
+        if verify is not True:
+            # requests lets REQUESTS_CA_BUNDLE override a session's verify, so keep the environment out of it
+            http_client = requests.Session()
+            http_client.verify = verify
+            http_client.trust_env = False
+        self._app = msal.ConfidentialClientApplication(
+            authority=authority,
+            client_id=client_id,
+            client_credential=client_secret,
+            token_cache=self._cache,
+            http_client=http_client,
+            # hosts other than Microsoft's, e.g. a local stand-in, are not known to instance discovery
+            instance_discovery=urlparse(authority).hostname in msal.authority.WELL_KNOWN_AUTHORITY_HOSTS,
+        )
+        self._lock = threading.Lock()
+        self._token: Optional[dict] = None
+        self._refresh_at = 0.0
+        self._timer: Optional[threading.Timer] = None
+
+    def cached_token(self) -> Optional[dict]:
+        """
+        Returns the current token without blocking, or None when it has to be acquired first.
+        """
+        token = self._token
+        if token is not None and time.time() < self._refresh_at:
+            return token
+        return None
+
+    def get_token(self) -> dict:
+        """
+        Returns a valid token, acquiring one only when the cached token is missing or about to expire.
+
+        Returns:
+            dict: The MSAL token response, including "access_token".
+        """
+        token = self.cached_token()
+        if token is not None:
+            return token
+        with self._lock:
+            if self._token is None or time.time() >= self._refresh_at:
+                self.__refresh__()
+            return self._token
+
+    def __refresh__(self, force: bool = False):
+        """
+        Acquires a token and schedules the next proactive refresh. Must be called with the lock held.
+
+        Args:
+            force (bool): Evict cached access tokens first, since MSAL would otherwise return
+                the cached one until it is within five minutes of expiry.
+        """
+        if force:
+            for access_token in self._cache.find(msal.TokenCache.CredentialType.ACCESS_TOKEN,
+                                                 query={"client_id": self._app.client_id}):
+                self._cache.remove_at(access_token)
+        token = self._app.acquire_token_for_client(scopes=GRAPH_SCOPES)
+        if "access_token" not in token:
+            raise Exception(f"Failed to acquire token: {token.get('error_description', token.get('error'))}")
+
+        expires_in = int(token.get("expires_in", 0))
+        # short-lived tokens are refreshed half way through their lifetime instead
+        self._token = token
+        self._refresh_at = time.time() + expires_in - min(self.refresh_margin, expires_in / 2)
+        self.__persist__()
+        self.__schedule_refresh__()
+        logging.info(f"<TokenProvider>:token valid for {token.get('expires_in')}s")
+
+    def __persist__(self):
+        if self._cache_path and self._cache.has_state_changed:
+            with open(self._cache_path, "w", encoding="utf-8") as f:
+                f.write(self._cache.serialize())
+
+    def __schedule_refresh__(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._refresh_at - time.time(), 1)
+        self._timer = threading.Timer(delay, self.__background_refresh__)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def __background_refresh__(self):
+        try:
+            with self._lock:
+                self.__refresh__(force=True)
+        except Exception as e:
+            # the next get_token call retries on the request path
+            logging.error(f"<TokenProvider>:background refresh failed: {e}")
+
+    def close(self):
+        """
+        Stops the background refresh.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+# (authority, client_id) -> TokenProvider, shared by every O365Client in the process
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(authority: str, client_id: str, client_secret: str,
+                       cache_path: Optional[str] = None,
+                       refresh_margin: int = DEFAULT_REFRESH_MARGIN,
+                       verify: Union[bool, str] = True) -> TokenProvider:
+    """
+    Returns the process-wide TokenProvider of an app registration, creating it on first use.
+
+    Args:
+        authority (str): The authority URL.
+        client_id (str): The application (client) id.
+        client_secret (str): The client secret.
+        cache_path (str): Optional file used to persist the MSAL token cache.
+        refresh_margin (int): Seconds before expiry at which the token is refreshed.
+        verify (bool or str): TLS verification of the authority, or a CA bundle to trust.
+
+    Returns:
+        TokenProvider: The shared provider.
+    """
+    key = (authority, client_id)
+    provider = _providers.get(key)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(key)
+            if provider is None:
+                provider = TokenProvider(authority, client_id, client_secret, cache_path, refresh_margin, verify)
+                _providers[key] = provider
+    return provider